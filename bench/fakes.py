@@ -0,0 +1,111 @@
+import re
+import time
+from datetime import datetime, timezone
+
+# Stand-ins for gspread and discord so SheetsCog runs without credentials or a gateway.
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows):
+        self.title = title
+        self.rows = rows
+
+    def get_all_values(self):
+        return [list(row) for row in self.rows]
+
+    def get_range(self, first_column, last_column):
+        # the sheets api trims trailing empty cells and rows, do the same
+        values = []
+        for row in self.rows:
+            cells = list(row[first_column:last_column + 1])
+            while cells and cells[-1] == '':
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+
+class FakeHTTPClient:
+    # implements the parts of gspread.http_client.HTTPClient used by utils.google_sheets
+    def __init__(self, worksheets):
+        self.worksheets = {sheet.title: sheet for sheet in worksheets}
+        self.modified = datetime.now(timezone.utc).isoformat()
+        self.calls = []
+
+    def values_batch_get(self, id, ranges, params=None):
+        self.calls.append('values_batch_get')
+        value_ranges = []
+        for a1_range in ranges:
+            match = re.fullmatch(r"'(.+)'!([A-Z]+):([A-Z]+)", a1_range)
+            title, first, last = match.groups()
+            values = self.worksheets[title].get_range(column_index(first), column_index(last))
+            value_ranges.append({'range': a1_range, 'values': values})
+        return {'spreadsheetId': id, 'valueRanges': value_ranges}
+
+    def get_file_drive_metadata(self, id):
+        self.calls.append('get_file_drive_metadata')
+        return {'id': id, 'modifiedTime': self.modified}
+
+    def values_append(self, id, range, params, body):
+        self.calls.append('values_append')
+        title = range.split('!')[0].strip("'")
+        self.worksheets[title].rows.extend(body['values'])
+        self.modified = datetime.now(timezone.utc).isoformat()
+        return {}
+
+
+class FakeClient:
+    def __init__(self, worksheets):
+        self.http_client = FakeHTTPClient(worksheets)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f'user{user_id}'
+
+
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+        self._done = False
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append((content, kwargs))
+        self._done = True
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+    def is_done(self):
+        return self._done
+
+
+class FakeFollowup:
+    def __init__(self, response):
+        self.response = response
+
+    async def send(self, content=None, **kwargs):
+        self.response.messages.append((content, kwargs))
+
+
+class FakeInteraction:
+    def __init__(self, user_id=1, guild_id=1):
+        self.user = FakeUser(user_id)
+        self.guild_id = guild_id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup(self.response)
+        self.created_at = datetime.fromtimestamp(time.time(), timezone.utc)
+
+
+class FakeBot:
+    def get_guild(self, guild_id):
+        return None
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Offline benchmarks for SheetsCog. Google Sheets and discord are replaced by the fakes in
+# bench/fakes.py, the sheets are generated by bench/synthetic.py.
+#
+#   python bench/run_bench.py --sizes 1000 10000 --output data/bench_report.json
+#   python bench/run_bench.py --baseline data/bench_report.json   # exit code 1 on regressions
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('GUILD_IDS', '1')
+os.environ.setdefault('SPREADSHEET_ID', 'bench')
+os.environ.setdefault('ICON_TALER_SERVER_ID', '0')
+
+from bench import synthetic  # noqa: E402
+from bench.fakes import FakeBot, FakeClient, FakeInteraction, FakeWorksheet  # noqa: E402
+from utils import google_sheets, sheets_scheduler  # noqa: E402
+from utils.catalog import build_catalog  # noqa: E402
+from utils.validation import validate  # noqa: E402
+
+# the fake backend has no quota
+sheets_scheduler.QUOTAS = {sheets_scheduler.READ: (10 ** 9,), sheets_scheduler.WRITE: (10 ** 9,)}
+
+from cogs.sheets_cog import SheetsCog  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def measure(call, iterations):
+    # per call latency in ms, then peak memory of a second, traced run
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await call(i)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        for i in range(min(iterations, 10)):
+            await call(i)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'calls': iterations,
+        'mean_ms': round(statistics.fmean(durations), 4),
+        'p50_ms': round(percentile(durations, 0.5), 4),
+        'p95_ms': round(percentile(durations, 0.95), 4),
+        'max_ms': round(max(durations), 4),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+async def bench_size(size, iterations):
+    names, items, suggestions, calculations = synthetic.generate(size)
+    google_sheets._client = FakeClient([
+        FakeWorksheet('Alle Items', items),
+        FakeWorksheet('Anpassungen', suggestions),
+        FakeWorksheet('Berechnungen', calculations),
+    ])
+    cog = SheetsCog(FakeBot())
+    rng = random.Random(size)
+    results = {}
+    try:
+        tenant = cog.tenants.for_guild(1)
+        results['load_sheet'] = await measure(lambda i: tenant.store.refresh(force=True), max(3, iterations // 50))
+        snapshot = tenant.store.snapshot
+        crafted = list(snapshot.recipes.recipes)
+
+        async def autocomplete(i):
+            # one user typing a name letter by letter
+            name = rng.choice(names)
+            interaction = FakeInteraction(user_id=i)
+            for length in range(1, min(len(name), 10) + 1):
+                await cog.item_autocomplete(interaction, name[:length])
+
+        async def search(i):
+            await SheetsCog.search.callback(cog, FakeInteraction(user_id=i), rng.choice(names), rng.randint(1, 20), rng.choice([None, 0.0, 15.0]))
+
+        async def recipe(i):
+            await SheetsCog.recipe.callback(cog, FakeInteraction(user_id=i), rng.choice(crafted), i % 2 == 0)
+
+        async def bulk_quote(i):
+            order = '; '.join(f'{rng.randint(1, 50)}x {rng.choice(names)}' for _ in range(200))
+            await SheetsCog.bulk_quote.callback(cog, FakeInteraction(user_id=i), order, '0 10 20 30')
+
+        async def validation(i):
+            # the sheet check runs while the catalog is built
+            validate(build_catalog(items), snapshot.recipes)
+
+        results['item_autocomplete'] = await measure(autocomplete, iterations)
+        results['search'] = await measure(search, iterations)
+        results['recipe'] = await measure(recipe, iterations)
+        results['bulk_quote'] = await measure(bulk_quote, max(3, iterations // 10))
+        results['validation'] = await measure(validation, max(3, iterations // 10))
+    finally:
+        await cog.tenants.close()
+        await cog.scheduler.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for size, results in report['results'].items():
+        for name, result in results.items():
+            old = baseline.get('results', {}).get(size, {}).get(name)
+            if old and result['p50_ms'] > old['p50_ms'] * (1 + tolerance):
+                regressions.append(f"{name} @ {size} rows: p50 {old['p50_ms']}ms -> {result['p50_ms']}ms")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Offline SheetsCog benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='rows of the synthetic sheets')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per command benchmark')
+    parser.add_argument('--output', default=os.path.join(REPO_ROOT, 'data', 'bench_report.json'))
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 slowdown against the baseline')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'iterations': args.iterations,
+        'results': {},
+    }
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # snapshots, journals and metrics end up in the temp dir instead of data/
+        os.chdir(workdir)
+        try:
+            for size in args.sizes:
+                report['results'][str(size)] = await bench_size(size, args.iterations)
+                for name, result in report['results'][str(size)].items():
+                    print(f"{size:>7} rows  {name:<26} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  peak {result['peak_kib']:>10.1f} KiB")
+        finally:
+            os.chdir(cwd)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}')
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import random
+
+QUALITIES = ['Einfache', 'Gute', 'Feine', 'Meisterhafte', 'Verstärkte', 'Alte', 'Große', 'Kleine']
+MATERIALS = ['Eisen', 'Stahl', 'Kupfer', 'Bronze', 'Eichen', 'Birken', 'Leder', 'Leinen', 'Woll', 'Stein', 'Silber', 'Gold']
+THINGS = ['schwert', 'axt', 'schild', 'helm', 'barren', 'brett', 'nagel', 'säge', 'hose', 'stiefel',
+          'handschuhe', 'rüstung', 'bogen', 'pfeil', 'kiste', 'tür', 'ring', 'kette', 'hammer', 'zange']
+RECIPE_COLUMNS = 52  # A:AZ
+TABLES = ((3, 5, 4, 14), (17, 19, 5, None), (32, 34, 9, None))  # same layout as utils.recipes
+
+
+def item_names(count, rng):
+    names = []
+    for i in range(count):
+        name = f'{rng.choice(QUALITIES)} {rng.choice(MATERIALS)}{rng.choice(THINGS)}'
+        names.append(f'{name} {i}')
+    return names
+
+
+def german_number(value):
+    return f'{value:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def items_sheet(names, rng, duplicate_rate=0.01, broken_rate=0.005):
+    rows = [['Name', 'Preis', 'Marge']]
+    for name in names:
+        price = f'{german_number(rng.uniform(1, 5000))} €'
+        margin = f'{rng.choice([0, 10, 15, 20, 25, 30])}%'
+        if rng.random() < broken_rate:
+            price = 'auf Anfrage'
+        rows.append([name, price, margin])
+    for _ in range(int(len(names) * duplicate_rate)):
+        rows.append(list(rng.choice(rows[1:])))
+    return rows
+
+
+def calculations_sheet(names, rng):
+    # every crafted item only uses items from earlier in the list, so the graph has no cycles.
+    # the first tenth of the items are raw materials without a recipe.
+    raw = max(1, len(names) // 10)
+    crafted = names[raw:]
+    rows = [[''] * RECIPE_COLUMNS]
+    rows[0][3], rows[0][17], rows[0][32] = 'Item', 'Item', 'Item'
+    for start in range(0, len(crafted), len(TABLES)):
+        row = [''] * RECIPE_COLUMNS
+        for (item_column, first, count, time_column), offset in zip(TABLES, range(len(TABLES))):
+            if start + offset >= len(crafted):
+                break
+            item = crafted[start + offset]
+            position = raw + start + offset
+            row[item_column] = item
+            for i in range(rng.randint(1, count)):
+                row[first + 2 * i] = names[rng.randrange(0, position)]
+                row[first + 2 * i + 1] = str(rng.randint(1, 10))
+            if time_column is not None:
+                row[time_column] = str(rng.randint(1, 120))
+        rows.append(row)
+    return rows
+
+
+def suggestions_sheet(names, rng, count=200):
+    # columns A:N of 'Anpassungen', new item suggestions live in G:I
+    rows = [['Datum', 'Item', 'Alter Preis', 'Neuer Preis', 'Benutzer', '', 'Datum', 'Item', 'Benutzer']]
+    for i in range(count):
+        rows.append(['01.01.24', rng.choice(names), '10', '12', 'user', '', '01.01.24', f'Neues Item {i}', 'user'])
+    return rows
+
+
+def generate(size, seed=42):
+    rng = random.Random(seed)
+    names = item_names(size, rng)
+    return names, items_sheet(names, rng), suggestions_sheet(names, rng), calculations_sheet(names, rng)
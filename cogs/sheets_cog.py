@@ -1,12 +1,17 @@
 import discord
-from discord.ext import commands
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from discord.ext import commands, tasks
 import os
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
+import time
 import asyncio
+import io
+from utils import metrics
+from utils.quote import build_quote, parse_margins, parse_order
+from utils.recipes import RecipeCycleError
+from utils.sheets_scheduler import SheetsScheduler
+from utils.tenants import TenantRegistry, guild_sheets_from_env
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,69 +20,101 @@ logger = logging.getLogger(__name__)
 load_dotenv(dotenv_path='config/.env')
 #guild_id = int(os.getenv('GUILD_ID'))
 # Get and verify environment variables
-guild_ids_env = os.getenv('GUILD_IDS')
-if guild_ids_env is None:
-    raise ValueError("GUILD_IDS environment variable is not set.")
-
-try:
-    guild_ids = [int(id) for id in guild_ids_env.split(',')]
-except ValueError:
-    raise ValueError("GUILD_IDS must be a comma-separated list of integers.")
-sheet_id = os.getenv('SPREADSHEET_ID')
+guild_sheets = guild_sheets_from_env()
+guild_ids = list(guild_sheets)
+# how often the background task checks the sheet for changes
+refresh_minutes = float(os.getenv('REFRESH_MINUTES', '5'))
+# prometheus textfile, e.g. for the node_exporter textfile collector
+metrics_file = os.getenv('METRICS_FILE', 'data/metrics.prom')
+# items (plus recipes) of all sheets kept in memory, idle sheets above it are dropped
+cache_max_items = int(os.getenv('CACHE_MAX_ITEMS', '300000'))
 
 # taler icon
 taler_icon_server_id = os.getenv('ICON_TALER_SERVER_ID')
 taler_icon_name = os.getenv('ICON_TALER_NAME')
 
-async def call_google_api():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds_path = 'config/credentials.json'
-    try:
-        creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
-        client = gspread.authorize(creds)
-        logger.info('Google Sheets client authenticated')
-        return client
-    except Exception as e:
-        logger.error(f'Google Sheets authentication failed: {e}')
-        raise
-
- 
 
 class SheetsCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.sheet_all_items = None
-        self.sheet_suggestions = None
-        self.sheet_calculations = None
-        self.data_cache = None
-        self.suggestions_cache = None
-        self.calculations_cache = None
-        
-    async def load_sheet(self, sheet_id):
-        
+        # one scheduler for all sheets, the google quota is per project
+        self.scheduler = SheetsScheduler()
+        self.tenants = TenantRegistry(guild_sheets, self.scheduler, cache_max_items)
+        self.taler_emoji = None
+        self.emoji_version = 0
+
+    async def cog_load(self):
+        self.scheduler.start()
+        self.tenants.start()
+        self.refresh_loop.start()
+        self.metrics_loop.start()
+
+    async def cog_unload(self):
+        self.refresh_loop.cancel()
+        self.metrics_loop.cancel()
+        # write everything that is still queued before the cog goes away
+        await self.tenants.close()
+        await self.scheduler.close()
+
+    @tasks.loop(minutes=refresh_minutes)
+    async def refresh_loop(self):
+        # the first run replaces the snapshots loaded from disk in setup().
+        # sheets dropped from memory are checked again when they are used
+        await asyncio.gather(*(tenant.store.refresh() for tenant in self.tenants.loaded()))
+        self.tenants.evict()
+
+    @tasks.loop(seconds=30)
+    async def metrics_loop(self):
+        self.update_gauges()
         try:
-            google_client = await call_google_api()
-            self.sheet_all_items = google_client.open_by_key(sheet_id).worksheet('Alle Items')
-            self.sheet_suggestions = google_client.open_by_key(sheet_id).worksheet('Anpassungen')
-            self.sheet_calculations = google_client.open_by_key(sheet_id).worksheet('Berechnungen')
-            logger.info("Loaded sheets")
-            self.data_cache = await asyncio.to_thread(self.sheet_all_items.get_all_values)
-            self.suggestions_cache = await asyncio.to_thread(self.sheet_suggestions.get_all_values)
-            self.calculations_cache = await asyncio.to_thread(self.sheet_calculations.get_all_values)
+            await asyncio.to_thread(metrics.registry.write_prometheus, metrics_file)
         except Exception as e:
-            logger.error(f'Error loading sheet: {e}')
+            logger.warning(f'Could not write metrics to {metrics_file}: {e}')
+
+    def update_gauges(self):
+        for tenant in self.tenants.tenants.values():
+            snapshot = tenant.store.snapshot
+            if snapshot is not None:
+                metrics.snapshot_age.set(round(snapshot.age(), 1), sheet=tenant.spreadsheet_id)
+                metrics.snapshot_items.set(len(snapshot.catalog), sheet=tenant.spreadsheet_id)
+            else:
+                # not in memory, no values instead of the ones from before it was dropped
+                metrics.snapshot_age.remove(sheet=tenant.spreadsheet_id)
+                metrics.snapshot_items.remove(sheet=tenant.spreadsheet_id)
+        metrics.queue_depth.set(sum(tenant.writer.queue_depth() for tenant in self.tenants.tenants.values()), queue='writer')
+        metrics.queue_depth.set(self.scheduler.queue_depth(), queue='google_api')
+
+    def stale_note(self, tenant):
+        if not tenant.store.is_stale():
+            return ''
+        stand = datetime.fromtimestamp(tenant.store.synced_at).strftime("%d.%m.%y %H:%M")
+        return f'\n*Stand der Preise: {stand}. Die Liste konnte seitdem nicht aktualisiert werden.*'
+
+    async def get_snapshot(self, interaction):
+        # returns (tenant, snapshot), snapshot is None after the user was told why
+        tenant = self.tenants.for_guild(interaction.guild_id)
+        if tenant is None:
+            await interaction.response.send_message('Für diesen Server ist keine Preisliste eingerichtet.')
+            return None, None
+        snapshot = await self.tenants.get_snapshot(tenant)
+        if snapshot is None:
+            await interaction.response.send_message('Die Liste konnte nicht geladen werden. Bitte versuche es später noch einmal.')
+        return tenant, snapshot
     
     
+    @metrics.timed('autocomplete')
     async def item_autocomplete(self, interaction: discord.Interaction, current: str) -> list[discord.app_commands.Choice[str]]:
-            if self.data_cache is None:
-                await self.load_sheet(sheet_id)
+            tenant = self.tenants.for_guild(interaction.guild_id)
+            if tenant is None:
+                return []
+            snapshot = await self.tenants.get_snapshot(tenant)
+            if snapshot is None:
+                return []
             try:
                 
-                item_names = [row[0] for row in self.data_cache[1:]]  # Items in column A
-
-                # Filter and provide auto-complete choices
-                choices = [discord.app_commands.Choice(name=item, value=item) for item in item_names if current.lower() in item.lower()]
-                return [choice for choice in choices if 1 <= len(choice.name) <= 100][:25]  # Limit the number of choices to 25
+                # Ranked matches, the index already limits them to 25 valid choices
+                matches = snapshot.search_index.search(current, user_id=interaction.user.id)
+                return [discord.app_commands.Choice(name=item, value=item) for item in matches]
             except Exception as e:
                 logger.error(f'Error during auto-complete: {e}')
                 return []
@@ -92,90 +129,103 @@ class SheetsCog(commands.Cog):
     
     
     def get_custom_emoji(self):
-        guild = self.bot.get_guild(int(taler_icon_server_id))
-        if guild:
-            for emoji in guild.emojis:
-                if str(emoji) == str(taler_icon_name):
-                    return str(emoji)                
-            return "Taler"
-        return None
+        # looked up once, on_guild_emojis_update makes the next call look again
+        if self.taler_emoji is None:
+            guild = self.bot.get_guild(int(taler_icon_server_id))
+            if guild:
+                self.taler_emoji = "Taler"
+                for emoji in guild.emojis:
+                    if str(emoji) == str(taler_icon_name):
+                        self.taler_emoji = str(emoji)
+                        break
+                # cached answers rendered with the old emoji are no longer used
+                self.emoji_version += 1
+        return self.taler_emoji
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(self, guild, before, after):
+        if guild.id == int(taler_icon_server_id):
+            self.taler_emoji = None
     
     @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
     @discord.app_commands.command(name='update', description='Lädt die aktuelle Preise des Google Sheets. Muss nach manuellen Preisänderungen ausgeführt werden.')
+    @metrics.timed('update')
     async def update(self, interaction:discord.Interaction):
-        await interaction.response.defer()
-        await self.load_sheet(sheet_id)
-        await interaction.followup.send('Die Liste wurde aktualisiert')
+        tenant = self.tenants.for_guild(interaction.guild_id)
+        if tenant is None:
+            await interaction.response.send_message('Für diesen Server ist keine Preisliste eingerichtet.')
+            return
+        await interaction.response.send_message('Die Liste wird aktualisiert...')
+        previous = tenant.store.snapshot
+        snapshot = await tenant.store.refresh(force=True, urgent=True)
+        self.tenants.touch(tenant)
+        if snapshot is None or snapshot is previous:
+            await interaction.followup.send('Die Liste konnte nicht aktualisiert werden. Es werden weiterhin die bisherigen Preise verwendet.')
+        else:
+            await interaction.followup.send('Die Liste wurde aktualisiert')
     
         
     @discord.app_commands.autocomplete(name=item_autocomplete)
     @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
     @discord.app_commands.command(name="suche", description="sucht einen Gegenstand und gibt den Listenpreis an")
     @discord.app_commands.describe(name="Name des gesuchten Gegenstandes", menge="Optional: gewünschte Menge", marge="Optional: gewünschte Marge in Prozent")
+    @metrics.timed('suche')
     async def search(self, interaction:discord.Interaction, name:str, menge:int = 1, marge: float = None):
-        if self.data_cache is None:
-            await self.load_sheet(sheet_id)
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
         try:
-            data = self.data_cache
-            item_names = [row[0] for row in data[1:]] # items in column A
-            prices = [
-                float(row[1].replace('€', '').replace('.', '').replace(',', '.').strip())
-                if row[1].replace('€', '').replace('.', '').replace(',', '').strip().replace('.', '', 1).isdigit()
-                else 0
-                for row in data[1:]
-            ]  # Prices in column B
-            margins = [
-                float(row[2].replace('€', '').replace(',', '.').strip().replace('%', ''))
-                if row[2].replace('€', '').replace(',', '.').strip().replace('%', '').replace('.', '', 1).isdigit()
-                else 0
-                for row in data[1:]
-            ]  # margins in column C
-           
             # find item
-            if name not in item_names:
+            catalog_item = snapshot.catalog.get(name)
+            if catalog_item is None:
                 await interaction.response.send_message(f'Item {name} ist nicht in der Liste. Mit dem Command "/item-vorschlagen" kannst du fehlende Items melden')
                 return
         
-            index = item_names.index(name)
-            item_price = prices[index]
-            standard_margin = margins[index]
-
-            # custom margin
-            if marge is not None:
-                marge_decimal = marge / 100
-                item_price = item_price / (1+standard_margin / 100) * (1+marge_decimal)
-            item_price = item_price * menge
-            show_price = self.format_number(item_price)
-            
             taler_icon = self.get_custom_emoji()
-            
-                
-            if menge > 1:
-                if marge is None:
-                    formatted_marge = self.format_margin(standard_margin)
-                    if standard_margin == 0:
-                        await interaction.response.send_message(f'{menge} {name} kosten **{show_price} {taler_icon}**')
-                    else:
-                        await interaction.response.send_message(f'{menge} {name} kosten **{show_price} {taler_icon}** bei einer Standardmarge von {formatted_marge}%')
-                else:
-                    formatted_marge = self.format_margin(marge)
-                    if marge == 0:
-                        await interaction.response.send_message(f'{menge} {name} kosten **{show_price} {taler_icon}** bei 0% Marge')
-                    else:
-                        await interaction.response.send_message(f'{menge} {name} kosten **{show_price} {taler_icon}** bei einer Marge von {formatted_marge}%')
-            else:
-                if marge is None:
-                    formatted_marge = self.format_margin(standard_margin)
-                    if standard_margin == 0:
-                        await interaction.response.send_message(f'{menge} {name} kostet **{show_price} {taler_icon}**')
+            # the answer only depends on the arguments, the snapshot and the emoji
+            cache_key = ('suche', name, menge, marge, self.emoji_version)
+            cached = snapshot.responses.get(cache_key)
+            if cached is None:
+                item_price = catalog_item.price
+                standard_margin = catalog_item.margin
+
+                # custom margin
+                if marge is not None:
+                    marge_decimal = marge / 100
+                    item_price = item_price / (1+standard_margin / 100) * (1+marge_decimal)
+                item_price = item_price * menge
+                show_price = self.format_number(item_price)
+
+                if menge > 1:
+                    if marge is None:
+                        formatted_marge = self.format_margin(standard_margin)
+                        if standard_margin == 0:
+                            message = f'{menge} {name} kosten **{show_price} {taler_icon}**'
+                        else:
+                            message = f'{menge} {name} kosten **{show_price} {taler_icon}** bei einer Standardmarge von {formatted_marge}%'
                     else:
-                        await interaction.response.send_message(f'{menge} {name} kostet **{show_price} {taler_icon}** bei einer Standardmarge von {formatted_marge}%')
+                        formatted_marge = self.format_margin(marge)
+                        if marge == 0:
+                            message = f'{menge} {name} kosten **{show_price} {taler_icon}** bei 0% Marge'
+                        else:
+                            message = f'{menge} {name} kosten **{show_price} {taler_icon}** bei einer Marge von {formatted_marge}%'
                 else:
-                    formatted_marge = self.format_margin(marge)
-                    if marge == 0:
-                        await interaction.response.send_message(f'{menge} {name} kostet **{show_price} {taler_icon}** bei 0% Marge')
+                    if marge is None:
+                        formatted_marge = self.format_margin(standard_margin)
+                        if standard_margin == 0:
+                            message = f'{menge} {name} kostet **{show_price} {taler_icon}**'
+                        else:
+                            message = f'{menge} {name} kostet **{show_price} {taler_icon}** bei einer Standardmarge von {formatted_marge}%'
                     else:
-                        await interaction.response.send_message(f'{menge} {name} kostet **{show_price} {taler_icon}** bei einer Marge von {formatted_marge}%')
+                        formatted_marge = self.format_margin(marge)
+                        if marge == 0:
+                            message = f'{menge} {name} kostet **{show_price} {taler_icon}** bei 0% Marge'
+                        else:
+                            message = f'{menge} {name} kostet **{show_price} {taler_icon}** bei einer Marge von {formatted_marge}%'
+                cached = (message, show_price)
+                snapshot.responses.put(cache_key, cached)
+            message, show_price = cached
+            await interaction.response.send_message(message + self.stale_note(tenant))
   
             logger.info(f'Found item {name} with amount {menge} for the price of {show_price}')
         except Exception as e:
@@ -187,28 +237,22 @@ class SheetsCog(commands.Cog):
     @discord.app_commands.describe(item="Name des Gegenstandes", neuer_preis="Neuer Preisvorschlag")
     @discord.app_commands.command(name="preisanpassung", description="Schlage eine Preisänderung vor")
     @discord.app_commands.autocomplete(item=item_autocomplete)
+    @metrics.timed('preisanpassung')
     async def price_suggestion(self, interaction:discord.Interaction, item: str, neuer_preis: float):
-        if self.data_cache is None:
-            await self.load_sheet(sheet_id)
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
         
         try:
-            data = self.data_cache
-            item_names = [row[0] for row in data[1:]]
-            if item not in item_names:
+            catalog_item = snapshot.catalog.get(item)
+            if catalog_item is None:
                 await interaction.response.send_message(f'Item {item} ist nicht in der Liste. Mit dem Command "/item-vorschlagen" kannst du fehlende Items melden.')
                 return
-            prices = [
-                float(row[1].replace('€', '').replace('.', '').replace(',', '.').strip())
-                if row[1].replace('€', '').replace('.', '').replace(',', '').strip().replace('.', '', 1).isdigit()
-                else 0
-                for row in data[1:]
-            ]
             timestamp = datetime.now().strftime("%d.%m.%y")
-            index = item_names.index(item)
-            old_price = prices[index]
+            old_price = catalog_item.price
             user = interaction.user.name
             suggestion_row = [timestamp,item, old_price, neuer_preis, user]
-            await asyncio.to_thread(self.sheet_suggestions.append_row,suggestion_row,table_range='A:E')
+            await tenant.writer.enqueue('A:E', suggestion_row)
             taler_icon = self.get_custom_emoji()
             await interaction.response.send_message(f'Preisanpassung für **{item}** von {old_price}{taler_icon} auf **{neuer_preis}{taler_icon}** vorgeschlagen. Der Stadtrat schaut sich die Vorschläge regelmässig an und nimmt wenn nötig, Änderungen an den Preisen vor.')
             logger.info(f'Price adjustment for {item} suggested by {user}: {old_price} -> {neuer_preis}')
@@ -220,28 +264,28 @@ class SheetsCog(commands.Cog):
     @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
     @discord.app_commands.command(name='neues-item', description='Schlägt ein fehlendes Item vor.')
     @discord.app_commands.describe(item="Name des fehlenden Gegenstandes")
+    @metrics.timed('neues-item')
     async def new_item_suggestion(self, interaction: discord.Interaction, item: str):
-        if self.data_cache is None:
-            await self.load_sheet(sheet_id)
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
 
         try:
             # Validate item
-            item_names = [row[0] for row in self.data_cache[1:]]
-            if item in item_names:
+            if item in snapshot.catalog:
                 await interaction.response.send_message(f'**{item}** ist bereits in der Liste.')
                 return
             # Validate item in new items cache
-            suggested_items = [row[1] for row in self.suggestions_cache[1:]]  # Items in column H
-            if item in suggested_items:
+            if item in snapshot.suggested_items or tenant.writer.is_pending('G:I', 1, item):
                 await interaction.response.send_message(f'**{item}** wurde bereits vorgeschlagen.')
                 return
-            # Append new item suggestion to the sheet
+            # Queue new item suggestion for the sheet
             timestamp = datetime.now().strftime("%d.%m.%y")
             user = interaction.user.name
             suggestion_row = [timestamp, item, user]
-            self.sheet_suggestions.append_row(suggestion_row, table_range='G:I')
+            await tenant.writer.enqueue('G:I', suggestion_row)
             # Update new items cache
-            self.suggestions_cache.append([timestamp, item, user])
+            snapshot.suggested_items.add(item)
 
             await interaction.response.send_message(f'Der Gegenstand **{item}** wird geprüft und sobald möglich der Liste hinzugefügt. Danke für die Meldung. Nutze den Befehl um weitere Gegenstände zu melden.')
             logger.info(f'New item {item} suggested by {user}')
@@ -253,95 +297,66 @@ class SheetsCog(commands.Cog):
 
     @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
     @discord.app_commands.command(name='rezept', description='Zeigt das Rezept eines Gegenstandes an.')
-    @discord.app_commands.describe(item="Name des Gegenstandes")
+    @discord.app_commands.describe(item="Name des Gegenstandes", komplett="Optional: Zutaten bis zu den Rohstoffen auflösen und Kosten berechnen")
     @discord.app_commands.autocomplete(item=item_autocomplete)
-    async def recipe(self, interaction: discord.Interaction, item: str):
-        if self.data_cache is None or self.calculations_cache is None:
-            await self.load_sheet(sheet_id)
+    @metrics.timed('rezept')
+    async def recipe(self, interaction: discord.Interaction, item: str, komplett: bool = False):
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
 
         try:
-            data = self.data_cache
-            item_names = [row[0] for row in data[1:]]
-            if item not in item_names:
+            catalog_item = snapshot.catalog.get(item)
+            if catalog_item is None:
                 await interaction.response.send_message(f'Item {item} ist nicht in der Liste. Mit dem Command "/item-vorschlagen" kannst du fehlende Items melden.')
                 return
-            prices = [
-                float(row[1].replace('€', '').replace('.', '').replace(',', '.').strip())
-                if row[1].replace('€', '').replace('.', '').replace(',', '').strip().replace('.', '', 1).isdigit()
-                else 0
-                for row in data[1:]
-            ]
-            margins = [
-                float(row[2].replace('€', '').replace(',', '.').strip().replace('%', ''))
-                if row[2].replace('€', '').replace(',', '.').strip().replace('%', '').replace('.', '', 1).isdigit()
-                else 0
-                for row in data[1:]
-            ] 
-
-            # Find the item row in calculations sheet
-            item_row = None
-            item_column = None
-            for row in self.calculations_cache:
-                if row[3] == item:
-                    item_row = row
-                    item_column = "D"
-                    break
-                elif row[17] == item:
-                    item_row = row
-                    item_column = "R"
-                    break
-                elif row[32] == item:
-                    item_row = row
-                    item_column = "AG"
-                    break
-
-            if not item_row:
+
+            recipe = snapshot.recipes.get(item)
+            if recipe is None:
                 await interaction.response.send_message(f'Kein Rezept für {item} gefunden.')
                 return
-            index = item_names.index(item)
-            ingredients = []
-            production_time = 0
-            recipe_link = ""       
-            if(item_column == "D"):
-                start = 5
-                production_time = item_row[14]
-                for i in range(0,7,2):  # Up to 4 ingredients
-                    ingredient = item_row[start  + i ]               
-                    quantity = item_row[start  + i + 1]
-                    if ingredient and quantity:
-                        ingredients.append((ingredient, quantity))
-            elif(item_column == "R"):
-                start = 19
-                for i in range(0,9,2):  # Up to 5 ingredients
-                    ingredient = item_row[start  + i ]           
-                    quantity = item_row[start  + i + 1]
-                    if ingredient and quantity:
-                        ingredients.append((ingredient, quantity))
-            elif(item_column == "AG"):
-                #item_links = [row[3] for row in data[1:]] #TODO: Change google sheet, add links in column D and update App scripts
-                #recipe_link =item_links[index]
-                start = 34
-                for i in range(0,17,2):  # Up to 9 ingredients
-                    ingredient = item_row[start  + i ]
-                    quantity = item_row[start  + i + 1]
-                    if ingredient and quantity:
-                        ingredients.append((ingredient, quantity))
-                    
-            # Find price of the item
-            
-            item_price = prices[index]
-            margin = margins[index]
             taler_icon = self.get_custom_emoji()
-            # Create an embed
-            embed = discord.Embed(title=f"Rezept für {item}", color=discord.Color.blue())
-            embed.add_field(name=f"Preis: {item_price} {taler_icon}", value=f"Marge: {margin}%", inline=False)
-            if production_time:
-                embed.set_footer(text=f"Herstellungszeit: {production_time} min")
-            elif recipe_link:
-                embed.set_footer(text=f"Spoiler: {recipe_link}")
-            embed.add_field(name="Zutaten", value="\n".join(f"{qty}x **{ing}**" for ing, qty in ingredients), inline=False)
-           
+            cache_key = ('rezept', item, komplett, self.emoji_version)
+            cached = snapshot.responses.get(cache_key)
+            if cached is None:
+                recipe_link = ""
+                #TODO: Change google sheet, add links in column D of 'Alle Items' and update App scripts for AG recipes
 
+                item_price = catalog_item.price
+                margin = catalog_item.margin
+                # Create an embed
+                embed = discord.Embed(title=f"Rezept für {item}", color=discord.Color.blue())
+                embed.add_field(name=f"Preis: {item_price} {taler_icon}", value=f"Marge: {margin}%", inline=False)
+                if recipe.production_time:
+                    embed.set_footer(text=f"Herstellungszeit: {recipe.production_time} min")
+                elif recipe_link:
+                    embed.set_footer(text=f"Spoiler: {recipe_link}")
+                embed.add_field(name="Zutaten", value="\n".join(f"{qty}x **{ing}**" for ing, qty in recipe.ingredients), inline=False)
+
+                if komplett:
+                    try:
+                        materials, raw_cost, missing = snapshot.recipes.raw_cost(item, snapshot.catalog)
+                    except RecipeCycleError as e:
+                        logger.warning(f'Recipe cycle for {item}: {e}')
+                        embed.add_field(name="Rohstoffe", value=f"Das Rezept enthält einen Kreislauf: {e}", inline=False)
+                    else:
+                        lines = [f"{self.format_number(round(amount, 2))}x **{material}**" for material, amount in sorted(materials.items())]
+                        value = "\n".join(lines)
+                        if len(value) > 1024:  # discord limit for field values
+                            value = value[:1000].rsplit("\n", 1)[0] + "\n…"
+                        embed.add_field(name="Rohstoffe", value=value, inline=False)
+                        cost_text = f"{self.format_number(round(raw_cost, 2))} {taler_icon}"
+                        if missing:
+                            cost_text += f" (ohne Preis: {', '.join(missing)})"
+                        embed.add_field(name="Kosten aus Rohstoffen", value=cost_text[:1024], inline=False)
+                cached = embed.to_dict()
+                snapshot.responses.put(cache_key, cached)
+
+            # a fresh embed for every answer, the stale note is not part of the cached one
+            embed = discord.Embed.from_dict(cached)
+            stale_note = self.stale_note(tenant)
+            if stale_note:
+                embed.description = stale_note.strip()
             await interaction.response.send_message(embed=embed)
         except Exception as e:
             logger.error(f'Error processing recipe command: {e}')
@@ -351,22 +366,23 @@ class SheetsCog(commands.Cog):
     @discord.app_commands.command(name='rezeptfehler', description='Melde einen Fehler im Rezept eines Gegenstandes.')
     @discord.app_commands.describe(item="Name des Gegenstandes", explanation="Erklärung des Fehlers")
     @discord.app_commands.autocomplete(item=item_autocomplete)
+    @metrics.timed('rezeptfehler')
     async def report_recipe_error(self, interaction: discord.Interaction, item: str, explanation: str):
-        if self.data_cache is None:
-            await self.load_sheet(sheet_id)
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
 
         try:
             # Validate item
-            item_names = [row[0] for row in self.data_cache[1:]]
-            if item not in item_names:
+            if item not in snapshot.catalog:
                 await interaction.response.send_message(f'Item {item} ist nicht in der Liste. Mit dem Command "/item-vorschlagen" kannst du fehlende Items melden.')
                 return
 
-            # Append error report to the sheet
+            # Queue error report for the sheet
             timestamp = datetime.now().strftime("%d.%m.%y")
             user = interaction.user.name
             report_row = [timestamp, item, explanation, user]
-            self.sheet_suggestions.append_row(report_row, table_range='K:N')
+            await tenant.writer.enqueue('K:N', report_row)
 
             await interaction.response.send_message(f'Fehlerbericht für **{item}** wurde eingereicht. Vielen Dank für deine Rückmeldung. Der Stadtrat wird sich darum kümmern.')
             logger.info(f'Recipe error reported for {item} by {user}: {explanation}')
@@ -376,26 +392,200 @@ class SheetsCog(commands.Cog):
    
    
    
-   # Function to find and print all duplicate items
-    async def find_and_print_duplicates(self):
-        if self.data_cache is None:
-            await self.load_sheet(sheet_id)
+    @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
+    @discord.app_commands.command(name='angebot', description='Berechnet den Preis einer ganzen Einkaufsliste')
+    @discord.app_commands.describe(liste='Gegenstände mit Menge, getrennt durch ";", z.B. "3x Eisenbarren; Holzbrett x 10"',
+                                   margen='Optional: Margen zum Vergleich in Prozent, z.B. "0 10 20 30"')
+    @metrics.timed('angebot')
+    async def bulk_quote(self, interaction: discord.Interaction, liste: str, margen: str = None):
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
         try:
-            item_names = [row[0] for row in self.data_cache[1:] if row[0]]  # Exclude empty strings
-            duplicates = set([item for item in item_names if item_names.count(item) > 1])
-            if duplicates:
-                logger.info(f'Duplicate items found: {duplicates}')
+            order = parse_order(liste)
+            if not order:
+                await interaction.response.send_message('Die Liste ist leer. Beispiel: "3x Eisenbarren; Holzbrett x 10"')
+                return
+            try:
+                margins = parse_margins(margen) if margen else []
+            except ValueError:
+                await interaction.response.send_message('Die Margen konnten nicht gelesen werden. Beispiel: "0 10 20 30"')
+                return
+            margins = margins[:5]
+            quote = build_quote(snapshot, order, margins)
+            taler_icon = self.get_custom_emoji()
+
+            lines = []
+            for i, name in enumerate(quote.names):
+                line = f'{quote.quantities[i]}x {name}: **{self.format_number(round(quote.totals[None][i], 2))}**'
+                if margins:
+                    line += ' (' + ' / '.join(self.format_number(round(quote.totals[margin][i], 2)) for margin in margins) + ')'
+                lines.append(line)
+            item_list = '\n'.join(lines)
+
+            embed = discord.Embed(title=f'Angebot für {len(quote.names)} Positionen', color=discord.Color.blue())
+            file = None
+            if len(item_list) > 4000:  # discord limit for embed descriptions
+                embed.description = 'Die Positionen stehen in der angehängten Datei.'
+                file = discord.File(io.BytesIO(item_list.replace('**', '').encode('utf-8')), filename='angebot.txt')
+            else:
+                embed.description = item_list
+            embed.add_field(name='Summe (Standardmarge)', value=f'**{self.format_number(round(quote.grand_total(None), 2))} {taler_icon}**', inline=False)
+            for margin in margins:
+                embed.add_field(name=f'Summe bei {self.format_margin(margin)}% Marge', value=f'{self.format_number(round(quote.grand_total(margin), 2))} {taler_icon}')
+            if quote.unknown:
+                embed.add_field(name='Nicht in der Liste', value=', '.join(quote.unknown)[:1024], inline=False)
+            stale_note = self.stale_note(tenant)
+            if stale_note:
+                embed.set_footer(text=stale_note.strip().strip('*'))
+
+            if file is not None:
+                await interaction.response.send_message(embed=embed, file=file)
+            else:
+                await interaction.response.send_message(embed=embed)
+            logger.info(f'Quoted {len(quote.names)} items for {interaction.user.name}, total {self.format_number(round(quote.grand_total(None), 2))}')
+        except Exception as e:
+            logger.error(f'Error processing quote command: {e}')
+            await interaction.response.send_message('Es gab einen Fehler bei der Verarbeitung des Befehls.')
+
+    @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
+    @discord.app_commands.command(name='preisverlauf', description='Zeigt, wie sich der Preis eines Gegenstandes verändert hat.')
+    @discord.app_commands.describe(item="Name des Gegenstandes", tage="Optional: Zeitraum in Tagen, Standard 90")
+    @discord.app_commands.autocomplete(item=item_autocomplete)
+    @metrics.timed('preisverlauf')
+    async def price_history(self, interaction: discord.Interaction, item: str, tage: discord.app_commands.Range[int, 1, 3650] = 90):
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
+        try:
+            since = time.time() - tage * 86400
+            trend = await asyncio.to_thread(tenant.history.trend, item, since)
+            if trend.last() is None:
+                await interaction.response.send_message(f'Für {item} gibt es noch keinen Preisverlauf.')
+                return
+            taler_icon = self.get_custom_emoji()
+
+            def price(point):
+                return f'{self.format_number(round(point[1], 2))} {taler_icon}'
+
+            def day(point):
+                return datetime.fromtimestamp(point[0]).strftime("%d.%m.%y")
+
+            def when(point):
+                # the starting price was set before the period, its date lies outside of it
+                return 'Startpreis' if point is trend.start else day(point)
+
+            first, last = trend.first(), trend.last()
+            embed = discord.Embed(title=f'Preisverlauf für {item}', color=discord.Color.blue())
+            embed.description = f'Aktuell: **{price(last)}** bei {self.format_margin(last[2])}% Marge, seit {day(last)}'
+            if last[1] == first[1]:
+                trend_text = 'unverändert'
+            elif first[1] == 0:
+                # no percentage from 0, e.g. a price cell that could not be read before
+                trend_text = f'neu bepreist ({price(first)} → {price(last)})'
+            else:
+                change = (last[1] - first[1]) / first[1] * 100
+                trend_text = f'{change:+.1f}% ({price(first)} → {price(last)})'
+            embed.add_field(name=f'Trend ({tage} Tage)', value=trend_text, inline=False)
+            lowest, highest = trend.lowest(), trend.highest()
+            embed.add_field(name='Minimum', value=f'{price(lowest)} ({when(lowest)})')
+            embed.add_field(name='Maximum', value=f'{price(highest)} ({when(highest)})')
+            embed.add_field(name='Änderungen', value=str(trend.change_count()))
+            if trend.changes:
+                lines = [f'{day(point)}: {price(point)}, {self.format_margin(point[2])}% Marge' for point in trend.changes[-10:]]
+                embed.add_field(name='Letzte Einträge', value='\n'.join(reversed(lines))[:1024], inline=False)
+            if trend.start is None:
+                # the history does not reach back to the start of the period
+                embed.set_footer(text=f'Aufgezeichnet seit {day(first)}')
+            await interaction.response.send_message(embed=embed)
+        except Exception as e:
+            logger.error(f'Error processing price history command: {e}')
+            await interaction.response.send_message('Es gab einen Fehler bei der Verarbeitung des Befehls.')
+
+    @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
+    @discord.app_commands.command(name='stats', description='Zeigt Laufzeitstatistiken des Bots an.')
+    @discord.app_commands.default_permissions(administrator=True)
+    async def stats(self, interaction: discord.Interaction):
+        self.update_gauges()
+
+        def seconds(value):
+            return '-' if value is None else f'≤{value}s'
+
+        lines = []
+        for command in sorted({dict(key)['command'] for key in metrics.command_duration.values}):
+            data = metrics.command_duration.values[(('command', command),)]
+            over_deadline = metrics.interaction_latency.count_over(metrics.INTERACTION_DEADLINE, command=command)
+            lines.append(f'**{command}**: {data[-1]}x, p50 {seconds(metrics.command_duration.quantile(0.5, command=command))}, '
+                         f'p95 {seconds(metrics.command_duration.quantile(0.95, command=command))}, über {metrics.INTERACTION_DEADLINE}s: {over_deadline}')
+        embed = discord.Embed(title='Statistiken', color=discord.Color.blue())
+        embed.add_field(name='Befehle', value='\n'.join(lines) or 'Noch keine Aufrufe', inline=False)
+
+        api_lines = []
+        for key, data in sorted(metrics.google_api_duration.values.items()):
+            call = dict(key)['call']
+            api_lines.append(f'**{call}**: {data[-1]}x, p95 {seconds(metrics.google_api_duration.quantile(0.95, call=call))}, '
+                             f'Fehler: {metrics.google_api_errors.get(call=call)}')
+        embed.add_field(name='Google API', value='\n'.join(api_lines) or 'Noch keine Aufrufe', inline=False)
+
+        cache_lines = []
+        for cache in sorted({dict(key)['cache'] for key in metrics.cache_requests.values}):
+            hits = metrics.cache_requests.get(cache=cache, result='hit')
+            misses = metrics.cache_requests.get(cache=cache, result='miss')
+            cache_lines.append(f'**{cache}**: {hits} Treffer, {misses} Fehlschläge')
+        embed.add_field(name='Caches', value='\n'.join(cache_lines) or '-', inline=False)
+
+        tenant = self.tenants.for_guild(interaction.guild_id)
+        snapshot = tenant.store.snapshot if tenant is not None else None
+        snapshot_age = f'{int(snapshot.age() // 60)} min' if snapshot is not None else 'nicht geladen'
+        writer_depth = tenant.writer.queue_depth() if tenant is not None else 0
+        embed.add_field(name='Liste', value=f'Alter: {snapshot_age}\nWarteschlange Schreiben: {writer_depth}\n'
+                                            f'Warteschlange Google: {self.scheduler.queue_depth()}\n'
+                                            f'Fehler im Log: {sum(metrics.errors.values.values())}', inline=False)
+        embed.add_field(name='Speicher', value=f'Geladene Listen: {len(self.tenants.loaded())} von {len(self.tenants.tenants)}\n'
+                                               f'Items im Speicher: {self.tenants.loaded_items()} von {self.tenants.max_items}\n'
+                                               f'Verdrängt: {metrics.snapshot_evictions.get()}', inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+   
+   
+    @discord.app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in guild_ids])
+    @discord.app_commands.command(name='pruefung', description='Zeigt Probleme in der Preisliste und den Rezepten an.')
+    @discord.app_commands.default_permissions(administrator=True)
+    @metrics.timed('pruefung')
+    async def validation_report(self, interaction: discord.Interaction):
+        tenant, snapshot = await self.get_snapshot(interaction)
+        if snapshot is None:
+            return
+        try:
+            report = snapshot.validation
+            sections = [
+                ('Doppelte Items', [f'{name} (Zeilen {", ".join(map(str, rows))})' for name, rows in report.duplicates.items()]),
+                ('Unlesbare Preise (zählen als 0)', [f'Zeile {row}: {name} "{cell}"' for row, name, cell in report.bad_prices]),
+                ('Unlesbare Margen (zählen als 0%)', [f'Zeile {row}: {name} "{cell}"' for row, name, cell in report.bad_margins]),
+                ('Zutaten ohne Eintrag in Alle Items', [f'{item}: {ingredient}' for item, ingredient in report.missing_ingredients]),
+            ]
+            embed = discord.Embed(title='Prüfung der Liste', color=discord.Color.green() if not report.issue_count() else discord.Color.orange())
+            for title, lines in sections:
+                value = '\n'.join(lines[:10]) or 'Keine'
+                if len(lines) > 10:
+                    value += f'\n… und {len(lines) - 10} weitere'
+                embed.add_field(name=f'{title}: {len(lines)}', value=value[:1024], inline=False)
+            if report.issue_count() > 10:
+                text = '\n\n'.join(f'{title}\n' + '\n'.join(lines) for title, lines in sections if lines)
+                file = discord.File(io.BytesIO(text.encode('utf-8')), filename='pruefung.txt')
+                await interaction.response.send_message(embed=embed, file=file, ephemeral=True)
             else:
-                logger.info('No duplicate items found.')
+                await interaction.response.send_message(embed=embed, ephemeral=True)
         except Exception as e:
-            logger.error(f'Error finding duplicates: {e}')
+            logger.error(f'Error processing validation command: {e}')
+            await interaction.response.send_message('Es gab einen Fehler bei der Verarbeitung des Befehls.')
 
 async def setup(bot: commands.Bot):
     try:
+        metrics.install_error_counter()
         sheets_cog = SheetsCog(bot)
-        await sheets_cog.load_sheet(sheet_id)
+        # with a saved snapshot commands work at once, the refresh loop reads google in the background
+        await sheets_cog.tenants.warm_up()
         await bot.add_cog(sheets_cog)
-        await sheets_cog.find_and_print_duplicates()
-        logger.info('SheetsCog loaded and Google Sheet loaded successfully.')
+        logger.info(f'SheetsCog loaded with {len(sheets_cog.tenants.loaded())} of {len(sheets_cog.tenants.tenants)} Google Sheets.')
     except Exception as e:
         logger.error(f'Error loading SheetsCog: {e}')
\ No newline at end of file
@@ -2,29 +2,30 @@ import discord
 from discord.ext import commands
 import os
 from dotenv import load_dotenv
+from utils.command_sync import sync_commands
+from utils.tenants import guild_sheets_from_env
 
 load_dotenv(dotenv_path='config/.env')
 token = os.getenv('DISCORD_TOKEN')
-guild_ids_str = os.getenv('GUILD_IDS')
-
-# Convert guild_ids_str to a list of integers
-try:
-    guild_ids = [int(id) for id in guild_ids_str.split(',')]
-except ValueError:
-    raise ValueError("GUILD_IDS must be a comma-separated list of integers.")
+# GUILD_SHEETS or GUILD_IDS, the same settings the sheets cog reads
+guild_ids = list(guild_sheets_from_env())
 
 
 intents = discord.Intents.default()
 intents.message_content = True  
 
-bot = commands.Bot( command_prefix='!', intents=intents)
+class Bot(commands.Bot):
+    async def setup_hook(self):
+        # runs once per process, on_ready fires again after every reconnect.
+        # guilds whose commands did not change since the last start are skipped
+        synced = await sync_commands(self, guild_ids)
+        print(f'Synced commands to {len(synced)} of {len(guild_ids)} guilds')
+
+
+bot = Bot( command_prefix='!', intents=intents)
 
 @bot.event
 async def on_ready():
-    for guild_id in guild_ids:
-            guild = discord.Object(id=guild_id)
-            await bot.tree.sync(guild=guild)
-            print(f'Synced commands to guild {guild_id}')
     print(f'We have logged in as {bot.user}')
     
 async def load_cogs():
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import sheet_writer
+from utils.sheet_writer import SheetWriter
+
+
+def read_journal(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f.read().splitlines()]
+
+
+class SheetWriterJournalTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.directory.name, 'pending_writes_test.json')
+        self.written = []
+        self.writer = SheetWriter(self.append_rows, self.journal_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def append_rows(self, table_range, rows):
+        self.written.append((table_range, list(rows)))
+
+    def fail_journal_writes(self, error, count):
+        write_journal = self.writer._write_journal
+        calls = []
+
+        def flaky(lines):
+            calls.append(lines)
+            if len(calls) <= count:
+                raise error
+            write_journal(lines)
+        return flaky
+
+    async def test_failed_journal_rewrite_is_retried_without_resending(self):
+        await self.writer.enqueue('A1:B1', ['Eisen', '10'])
+        # after the write and again at the end of the flush
+        self.writer._write_journal = self.fail_journal_writes(OSError('disk full'), 2)
+
+        await self.writer.flush()
+        self.assertEqual(self.written, [('A1:B1', [['Eisen', '10']])])
+        self.assertEqual(read_journal(self.journal_path), [['A1:B1', ['Eisen', '10']]])
+
+        await self.writer.flush()
+        self.assertEqual(len(self.written), 1)
+        self.assertEqual(read_journal(self.journal_path), [])
+
+    async def test_background_flush_survives_an_error(self):
+        flush = self.writer.flush
+        calls = []
+
+        async def flaky_flush():
+            calls.append(None)
+            if len(calls) == 1:
+                raise OSError('disk full')
+            await flush()
+
+        self.writer.flush = flaky_flush
+        with mock.patch.object(sheet_writer, 'FLUSH_INTERVAL', 0.01):
+            self.writer.start()
+            await self.writer.enqueue('A1:B1', ['Eisen', '10'])
+            for _ in range(100):
+                if self.written:
+                    break
+                await asyncio.sleep(0.01)
+            await self.writer.close()
+
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(self.written, [('A1:B1', [['Eisen', '10']])])
+        self.assertEqual(self.writer.queue_depth(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+from array import array
+from types import MappingProxyType
+
+
+def parse_price(cell):
+    # prices look like "1.234,50 €" (german number format)
+    value = cell.replace('€', '').replace('.', '').replace(',', '.').strip()
+    if value.replace('.', '', 1).isdigit():
+        return float(value)
+    return None
+
+
+def parse_margin(cell):
+    # margins look like "25 %" or "12,5%"
+    value = cell.replace('€', '').replace(',', '.').replace('%', '').strip()
+    if value.replace('.', '', 1).isdigit():
+        return float(value)
+    return None
+
+
+class CatalogItem:
+    __slots__ = ('name', 'price', 'margin', 'row')
+
+    def __init__(self, name, price, margin, row):
+        self.name = name
+        self.price = price
+        self.margin = margin
+        self.row = row  # index of the item in the data rows (header excluded)
+
+    def __repr__(self):
+        return f'CatalogItem({self.name!r}, price={self.price}, margin={self.margin})'
+
+
+class Catalog:
+    __slots__ = ('items', 'names', 'positions', 'prices', 'margins', 'duplicates', 'bad_prices', 'bad_margins')
+
+    def __init__(self, items, duplicates, bad_prices, bad_margins):
+        self.items = MappingProxyType(items)
+        self.names = tuple(items)
+        # column arrays in the order of names, for calculations over many items at once
+        self.positions = {name: position for position, name in enumerate(self.names)}
+        self.prices = array('d', (item.price for item in items.values()))
+        self.margins = array('d', (item.margin for item in items.values()))
+        # rows build_catalog could not take as they are, for the sheet check
+        self.duplicates = duplicates  # name -> sheet rows the name appears in
+        self.bad_prices = bad_prices  # [(sheet row, name, cell)], these items cost 0
+        self.bad_margins = bad_margins  # [(sheet row, name, cell)], these items have 0% margin
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def get(self, name):
+        return self.items.get(name)
+
+
+def build_catalog(rows):
+    # rows of 'Alle Items' including the header: name in A, price in B, margin in C
+    items = {}
+    rows_by_name = {}
+    bad_prices = []
+    bad_margins = []
+    for row_index, row in enumerate(rows[1:]):
+        name = row[0] if row else ''
+        if not name:
+            continue
+        sheet_row = row_index + 2  # sheet rows are 1-based, row 1 is the header
+        rows_by_name.setdefault(name, []).append(sheet_row)
+        price_cell = row[1] if len(row) > 1 else ''
+        price = parse_price(price_cell)
+        if price is None:
+            bad_prices.append((sheet_row, name, price_cell))
+        margin_cell = row[2] if len(row) > 2 else ''
+        margin = parse_margin(margin_cell) if margin_cell else None
+        if margin_cell and margin is None:
+            # an empty margin is a deliberate 0%, anything else that does not parse is a typo
+            bad_margins.append((sheet_row, name, margin_cell))
+        if name in items:
+            # the first occurrence wins, like list.index() did before
+            continue
+        items[name] = CatalogItem(name, price if price is not None else 0.0, margin if margin is not None else 0.0, row_index)
+    duplicates = {name: sheet_rows for name, sheet_rows in rows_by_name.items() if len(sheet_rows) > 1}
+    return Catalog(items, duplicates, bad_prices, bad_margins)
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+import discord
+
+from utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+SYNC_STATE_PATH = os.path.join('data', 'command_sync.json')
+# guild syncs running at the same time, discord.py waits out rate limits on its own
+MAX_CONCURRENT_SYNCS = 3
+
+
+def tree_hash(tree, guild):
+    # the payload discord gets for this guild, so any change to a command changes the hash
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command.get('type', 1), command['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f'Ignoring unreadable command sync state {path}: {e}')
+        return {}
+
+
+def save_state(path, state):
+    with atomic_write(path, encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+
+async def sync_commands(bot, guild_ids, path=SYNC_STATE_PATH):
+    # uploads the command tree only to guilds whose commands changed since the last sync.
+    # returns the guild ids that were synced
+    state = load_state(path)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SYNCS)
+
+    async def sync(guild_id, key, digest):
+        async with semaphore:
+            try:
+                await bot.tree.sync(guild=discord.Object(id=guild_id))
+            except discord.HTTPException as e:
+                logger.error(f'Could not sync commands to guild {guild_id}: {e}')
+                return None
+        state[key] = digest
+        logger.info(f'Synced commands to guild {guild_id}')
+        return guild_id
+
+    jobs = []
+    for guild_id in guild_ids:
+        # the hash is only valid for the application it was uploaded to
+        key = f'{bot.application_id}:{guild_id}'
+        digest = tree_hash(bot.tree, discord.Object(id=guild_id))
+        if state.get(key) == digest:
+            logger.info(f'Commands of guild {guild_id} are up to date')
+            continue
+        jobs.append(sync(guild_id, key, digest))
+    synced = [guild_id for guild_id in await asyncio.gather(*jobs) if guild_id is not None]
+    if synced:
+        save_state(path, state)
+    return synced
@@ -0,0 +1,21 @@
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', opener=open, fsync=False, **kwargs):
+    # writes to a temp file next to path and swaps it in, so readers and crashes
+    # never see half a file. opener is open or e.g. gzip.open, kwargs go to it
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    try:
+        with opener(tmp_path, mode, **kwargs) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
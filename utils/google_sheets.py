@@ -0,0 +1,63 @@
+import logging
+import threading
+
+import gspread
+from requests.adapters import HTTPAdapter
+
+from utils.sheets_scheduler import MAX_CONCURRENT
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+CREDENTIALS_PATH = 'config/credentials.json'
+HTTP_TIMEOUT = (10, 45)  # seconds to connect, seconds to wait for data
+
+# only the columns the bot reads, all fetched with one request
+ITEMS_RANGE = "'Alle Items'!A:C"              # name, price, margin
+SUGGESTIONS_RANGE = "'Anpassungen'!G:I"       # date, item, user of the new item suggestions
+CALCULATIONS_RANGE = "'Berechnungen'!A:AZ"    # recipe tables D, R and AG
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # one authorised client for the whole process. google-auth refreshes the token and
+    # the underlying requests session keeps its connections open between calls.
+    global _client
+    with _client_lock:
+        if _client is None:
+            try:
+                client = gspread.service_account(filename=CREDENTIALS_PATH, scopes=SCOPES)
+                client.http_client.set_timeout(HTTP_TIMEOUT)
+                # one kept-alive connection per scheduler thread instead of requests' default of 10
+                client.http_client.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT))
+                _client = client
+                logger.info('Google Sheets client authenticated')
+            except Exception as e:
+                logger.error(f'Google Sheets authentication failed: {e}')
+                raise
+        return _client
+
+
+def fetch_values(spreadsheet_id):
+    # returns (item_rows, suggestion_rows, calculation_rows)
+    response = get_client().http_client.values_batch_get(
+        spreadsheet_id,
+        [ITEMS_RANGE, SUGGESTIONS_RANGE, CALCULATIONS_RANGE],
+    )
+    return tuple(value_range.get('values', []) for value_range in response['valueRanges'])
+
+
+def fetch_revision(spreadsheet_id):
+    # modified time from the drive metadata, much cheaper than downloading the values
+    return get_client().http_client.get_file_drive_metadata(spreadsheet_id)['modifiedTime']
+
+
+def append_rows(spreadsheet_id, sheet_name, table_range, rows):
+    get_client().http_client.values_append(
+        spreadsheet_id,
+        f"'{sheet_name}'!{table_range}",
+        params={'valueInputOption': 'RAW'},
+        body={'values': rows},
+    )
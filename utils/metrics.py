@@ -0,0 +1,183 @@
+import functools
+import logging
+import time
+
+from utils.files import atomic_write
+
+# seconds; discord drops an interaction that is not answered within 3 seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 30)
+INTERACTION_DEADLINE = 3
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, (), value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+    def remove(self, **labels):
+        self.values.pop(_label_key(labels), None)
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+                break
+        data[-2] += value
+        data[-1] += 1
+
+    def quantile(self, q, **labels):
+        # upper bound of the bucket holding the q-quantile, None above the last bucket
+        data = self.values.get(_label_key(labels))
+        if not data or not data[-1]:
+            return None
+        target = q * data[-1]
+        cumulative = 0
+        for bound, count in zip(self.buckets, data):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return None
+
+    def count_over(self, threshold, **labels):
+        data = self.values.get(_label_key(labels))
+        if not data:
+            return 0
+        within = sum(count for bound, count in zip(self.buckets, data) if bound <= threshold)
+        return data[-1] - within
+
+    def samples(self):
+        for key, data in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield f'{self.name}_bucket', key, (('le', bound),), cumulative
+            yield f'{self.name}_bucket', key, (('le', '+Inf'),), data[-1]
+            yield f'{self.name}_sum', key, (), data[-2]
+            yield f'{self.name}_count', key, (), data[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._add(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, key, extra, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key, extra)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # the textfile collector must never read half a file
+        with atomic_write(path, encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+
+
+registry = Registry()
+command_duration = registry.histogram('paxbot_command_duration_seconds', 'Time spent in a command or autocomplete handler')
+interaction_latency = registry.histogram('paxbot_interaction_latency_seconds', 'Time from the interaction being created to the handler finishing')
+google_api_duration = registry.histogram('paxbot_google_api_duration_seconds', 'Duration of Google API calls')
+google_api_errors = registry.counter('paxbot_google_api_errors_total', 'Failed Google API calls, retries included')
+cache_requests = registry.counter('paxbot_cache_requests_total', 'Cache lookups by cache and result')
+errors = registry.counter('paxbot_errors_total', 'Errors logged by the bot')
+snapshot_age = registry.gauge('paxbot_snapshot_age_seconds', 'Age of the loaded sheet snapshot')
+snapshot_items = registry.gauge('paxbot_snapshot_items', 'Items in the loaded sheet snapshot')
+snapshot_evictions = registry.counter('paxbot_snapshot_evictions_total', 'Idle sheet snapshots dropped to stay within the cache budget')
+queue_depth = registry.gauge('paxbot_queue_depth', 'Pending jobs by queue')
+
+
+def timed(name):
+    # records the handler duration and how close the interaction got to the discord deadline.
+    # the handlers are methods, so the interaction is always the second argument.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                command_duration.observe(time.perf_counter() - start, command=name)
+                created_at = getattr(args[1], 'created_at', None) if len(args) > 1 else None
+                if created_at is not None:
+                    interaction_latency.observe(time.time() - created_at.timestamp(), command=name)
+        return wrapper
+    return decorator
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record):
+        errors.inc(logger=record.name)
+
+
+def install_error_counter():
+    root = logging.getLogger()
+    if not any(isinstance(handler, ErrorCounter) for handler in root.handlers):
+        root.addHandler(ErrorCounter())
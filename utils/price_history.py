@@ -0,0 +1,100 @@
+import contextlib
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# price_changes only gets a row when an item's price or margin differs from latest_prices,
+# the first row of an item is its price when the history started
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS price_changes (
+    item TEXT NOT NULL,
+    ts REAL NOT NULL,
+    price REAL NOT NULL,
+    margin REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS price_changes_item_ts ON price_changes (item, ts);
+CREATE TABLE IF NOT EXISTS latest_prices (
+    item TEXT PRIMARY KEY,
+    price REAL NOT NULL,
+    margin REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def history_path(spreadsheet_id):
+    return os.path.join('data', f'price_history_{spreadsheet_id}.sqlite3')
+
+
+class PriceTrend:
+    __slots__ = ('item', 'start', 'changes')
+
+    def __init__(self, item, start, changes):
+        self.item = item
+        self.start = start  # (ts, price, margin) valid at the start of the period, or None
+        self.changes = changes  # [(ts, price, margin)] within the period, oldest first
+
+    def points(self):
+        return ([self.start] if self.start is not None else []) + self.changes
+
+    def first(self):
+        points = self.points()
+        return points[0] if points else None
+
+    def last(self):
+        points = self.points()
+        return points[-1] if points else None
+
+    def lowest(self):
+        return min(self.points(), key=lambda point: point[1], default=None)
+
+    def highest(self):
+        return max(self.points(), key=lambda point: point[1], default=None)
+
+    def change_count(self):
+        # the first row of an item is where the history started, not a change
+        return len(self.changes) - (1 if self.start is None and self.changes else 0)
+
+
+class PriceHistory:
+    # Blocking sqlite access, call it from a thread. Every call opens its own connection,
+    # so record() in the refresh thread and trend() for a command never share one.
+
+    def __init__(self, path):
+        self.path = path
+        self._schema_ready = False
+
+    @contextlib.contextmanager
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            if not self._schema_ready:
+                connection.executescript(SCHEMA)
+                self._schema_ready = True
+            with connection:  # one transaction
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, catalog, ts):
+        # appends the items whose price or margin changed since the last record, returns their number
+        with self._connect() as connection:
+            latest = {item: (price, margin) for item, price, margin in connection.execute('SELECT item, price, margin FROM latest_prices')}
+            changes = [(name, ts, price, margin) for name, price, margin in zip(catalog.names, catalog.prices, catalog.margins)
+                       if latest.get(name) != (price, margin)]
+            if changes:
+                connection.executemany('INSERT INTO price_changes (item, ts, price, margin) VALUES (?, ?, ?, ?)', changes)
+                connection.executemany('INSERT OR REPLACE INTO latest_prices (item, price, margin) VALUES (?, ?, ?)',
+                                       [(name, price, margin) for name, _, price, margin in changes])
+        return len(changes)
+
+    def trend(self, item, since):
+        with self._connect() as connection:
+            start = connection.execute('SELECT ts, price, margin FROM price_changes WHERE item = ? AND ts < ? ORDER BY ts DESC LIMIT 1',
+                                       (item, since)).fetchone()
+            changes = connection.execute('SELECT ts, price, margin FROM price_changes WHERE item = ? AND ts >= ? ORDER BY ts',
+                                         (item, since)).fetchall()
+        return PriceTrend(item, start, changes)
@@ -0,0 +1,94 @@
+import re
+
+from utils.search_index import normalize
+
+MAX_LINES = 500
+
+# "3x Eisenbarren", "3 x Eisenbarren", "3 Eisenbarren"
+_LEADING_QUANTITY = re.compile(r'^(\d+)\s*[x×*]?\s+(.+)$', re.IGNORECASE)
+# "Eisenbarren x3", "Eisenbarren × 3", "Eisenbarren 3"
+_TRAILING_QUANTITY = re.compile(r'^(.+?)\s+[x×*]?\s*(\d+)$', re.IGNORECASE)
+
+
+def parse_order(text):
+    # one line per item, separated by new lines or semicolons.
+    # returns [(name, quantity, line)], the line is kept for names that end in a number
+    lines = []
+    for line in re.split(r'[\n;]', text):
+        line = line.strip()
+        if not line:
+            continue
+        match = _LEADING_QUANTITY.match(line)
+        if match:
+            quantity, name = match.groups()
+        else:
+            match = _TRAILING_QUANTITY.match(line)
+            if match:
+                name, quantity = match.groups()
+            else:
+                name, quantity = line, '1'
+        lines.append((name.strip(), int(quantity), line))
+    return lines
+
+
+def parse_margins(text):
+    # "0, 10, 20 30%" -> [0.0, 10.0, 20.0, 30.0]
+    return [float(part) for part in re.split(r'[\s,;/%]+', text) if part]
+
+
+def resolve(snapshot, name):
+    # exact name first, then the same name ignoring case and umlaut spelling
+    if name in snapshot.catalog.positions:
+        return snapshot.catalog.positions[name]
+    index = snapshot.search_index
+    item_id = index.exact.get(normalize(name))
+    if item_id is not None:
+        return snapshot.catalog.positions.get(index.names[item_id])
+    return None
+
+
+class Quote:
+    __slots__ = ('names', 'quantities', 'unit_prices', 'margins', 'totals', 'scenarios', 'unknown')
+
+    def __init__(self, names, quantities, unit_prices, margins, totals, scenarios, unknown):
+        self.names = names
+        self.quantities = quantities
+        self.unit_prices = unit_prices  # list prices at the standard margin
+        self.margins = margins  # standard margin per line
+        self.totals = totals  # scenario -> line totals
+        self.scenarios = scenarios  # None for the standard margin, else the margin in percent
+        self.unknown = unknown
+
+    def grand_total(self, scenario):
+        return sum(self.totals[scenario])
+
+
+def build_quote(snapshot, order, margins=()):
+    catalog = snapshot.catalog
+    positions = []
+    quantities = []
+    unknown = []
+    for name, quantity, line in order[:MAX_LINES]:
+        position = resolve(snapshot, name)
+        if position is None and line != name:
+            # "Werkzeug Stufe 2" is an item, not 2x "Werkzeug Stufe"
+            position = resolve(snapshot, line)
+            quantity = 1
+        if position is None:
+            unknown.append(line)
+        else:
+            positions.append(position)
+            quantities.append(quantity)
+
+    # gather the columns once, then every scenario is one pass over them
+    prices = [catalog.prices[position] for position in positions]
+    standard_margins = [catalog.margins[position] for position in positions]
+    base_prices = [price / (1 + margin / 100) for price, margin in zip(prices, standard_margins)]
+
+    scenarios = [None, *margins]
+    totals = {None: [price * quantity for price, quantity in zip(prices, quantities)]}
+    for margin in margins:
+        factor = 1 + margin / 100
+        totals[margin] = [base * factor * quantity for base, quantity in zip(base_prices, quantities)]
+    names = [catalog.names[position] for position in positions]
+    return Quote(names, quantities, prices, standard_margins, totals, scenarios, unknown)
@@ -0,0 +1,112 @@
+from types import MappingProxyType
+
+# layout of the 'Berechnungen' sheet: three tables next to each other.
+# item column -> (tier, first ingredient column, max ingredients, production time column)
+RECIPE_TABLES = {
+    3: (1, 5, 4, 14),      # D
+    17: (2, 19, 5, None),  # R
+    32: (3, 34, 9, None),  # AG
+}
+COLUMN_NAMES = {3: 'D', 17: 'R', 32: 'AG'}
+
+
+class RecipeCycleError(ValueError):
+    pass
+
+
+class Recipe:
+    __slots__ = ('item', 'ingredients', 'production_time', 'tier', 'column')
+
+    def __init__(self, item, ingredients, production_time, tier, column):
+        self.item = item
+        self.ingredients = ingredients  # tuple of (ingredient, quantity as written in the sheet)
+        self.production_time = production_time
+        self.tier = tier
+        self.column = column
+
+    def __repr__(self):
+        return f'Recipe({self.item!r}, {self.ingredients!r})'
+
+
+def parse_quantity(quantity):
+    try:
+        return float(str(quantity).replace(',', '.').strip())
+    except ValueError:
+        return None
+
+
+def _cell(row, index):
+    return row[index] if index < len(row) else ''
+
+
+def build_recipes(rows):
+    recipes = {}
+    for row in rows:
+        # the first match wins (top to bottom, then D, R, AG) like the old row by row scan
+        for item_column, (tier, start, count, time_column) in RECIPE_TABLES.items():
+            item = _cell(row, item_column)
+            if not item or item in recipes:
+                continue
+            ingredients = []
+            for i in range(0, count * 2, 2):
+                ingredient = _cell(row, start + i)
+                quantity = _cell(row, start + i + 1)
+                if ingredient and quantity:
+                    ingredients.append((ingredient, quantity))
+            production_time = _cell(row, time_column) if time_column is not None else 0
+            recipes[item] = Recipe(item, tuple(ingredients), production_time, tier, COLUMN_NAMES[item_column])
+    return RecipeBook(recipes)
+
+
+class RecipeBook:
+    __slots__ = ('recipes', '_expanded')
+
+    def __init__(self, recipes):
+        self.recipes = MappingProxyType(recipes)
+        self._expanded = {}
+
+    def __contains__(self, item):
+        return item in self.recipes
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def get(self, item):
+        return self.recipes.get(item)
+
+    def raw_materials(self, item):
+        # expands the recipe tree of one unit of item down to ingredients without a recipe.
+        # returns {raw material: quantity}, sub trees are memoised per snapshot.
+        return self._expand(item, ())
+
+    def _expand(self, item, path):
+        if item in self._expanded:
+            return self._expanded[item]
+        if item in path:
+            raise RecipeCycleError(' -> '.join(path + (item,)))
+        recipe = self.recipes.get(item)
+        if recipe is None or not recipe.ingredients:
+            return {item: 1.0}
+
+        materials = {}
+        for ingredient, quantity in recipe.ingredients:
+            amount = parse_quantity(quantity)
+            if amount is None:
+                continue
+            for material, material_amount in self._expand(ingredient, path + (item,)).items():
+                materials[material] = materials.get(material, 0) + amount * material_amount
+        self._expanded[item] = materials
+        return materials
+
+    def raw_cost(self, item, catalog):
+        # cost of crafting one unit from scratch, priced with the list prices of the raw materials
+        materials = self.raw_materials(item)
+        total = 0
+        missing = []
+        for material, amount in materials.items():
+            catalog_item = catalog.get(material)
+            if catalog_item is None or not catalog_item.price:
+                missing.append(material)
+            else:
+                total += catalog_item.price * amount
+        return materials, total, missing
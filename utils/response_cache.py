@@ -0,0 +1,32 @@
+from collections import OrderedDict
+
+from utils import metrics
+
+MAX_SIZE = 256
+
+
+class ResponseCache:
+    # Rendered command answers of one snapshot, least recently used dropped first.
+    # Every snapshot has its own, so a refresh starts with an empty cache.
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            metrics.cache_requests.inc(cache='responses', result='miss')
+            return None
+        metrics.cache_requests.inc(cache='responses', result='hit')
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,159 @@
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+
+from utils import metrics
+
+MAX_RESULTS = 25
+MAX_NAME_LENGTH = 100  # discord rejects longer choice names
+FUZZY_CANDIDATES = 100
+FUZZY_CUTOFF = 0.75
+MEMO_SIZE = 512
+
+# ranks, lower is better
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+
+_REPLACEMENTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+
+def normalize(text):
+    # "Schwert aus Stahl" -> "schwert aus stahl", "Große Säge" -> "grosse saege"
+    text = text.lower().translate(_REPLACEMENTS)
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.split())
+
+
+def fold(text):
+    # spelling-insensitive form so "kase" finds "Käse" and "strase" finds "Straße"
+    for digraph, letter in (('ae', 'a'), ('oe', 'o'), ('ue', 'u'), ('ss', 's')):
+        text = text.replace(digraph, letter)
+    return text
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, names):
+        self.names = [name for name in names if 1 <= len(name) <= MAX_NAME_LENGTH]
+        self.normalized = [normalize(name) for name in self.names]
+        self.folded = [fold(norm) for norm in self.normalized]
+
+        self.exact = {}
+        for item_id, norm in enumerate(self.normalized):
+            self.exact.setdefault(norm, item_id)
+
+        # sorted (key, id) pairs for bisect prefix lookups
+        self.sorted_names = sorted((norm, item_id) for item_id, norm in enumerate(self.normalized))
+        words = []
+        for item_id, norm in enumerate(self.normalized):
+            for word in set(norm.split(' ')[1:]):
+                words.append((word, item_id))
+        self.sorted_words = sorted(words)
+
+        self.trigram_index = {}
+        for item_id, folded in enumerate(self.folded):
+            for gram in trigrams(folded):
+                self.trigram_index.setdefault(gram, []).append(item_id)
+
+        # user id -> (folded query, ids containing it), used to narrow extended queries
+        self.memo = OrderedDict()
+
+    def search(self, query, user_id=None, limit=MAX_RESULTS):
+        query = normalize(query)
+        if not query:
+            return self.names[:limit]
+
+        substring_ids = self._substring_matches(query, user_id)
+        found = {}
+
+        def add(item_id, rank):
+            if item_id not in found:
+                found[item_id] = rank
+            return len(found) >= limit
+
+        item_id = self.exact.get(query)
+        if item_id is not None:
+            add(item_id, EXACT)
+
+        done = (self._scan_prefix(self.sorted_names, query, add, PREFIX)
+                or self._scan_prefix(self.sorted_words, query, add, WORD_PREFIX))
+        if not done:
+            for item_id in sorted(substring_ids, key=lambda i: (len(self.normalized[i]), self.normalized[i])):
+                if add(item_id, SUBSTRING):
+                    done = True
+                    break
+        if not done:
+            for item_id in self._fuzzy_matches(query, found):
+                if add(item_id, FUZZY):
+                    break
+
+        ranked = sorted(found, key=lambda i: (found[i], len(self.normalized[i]), self.normalized[i]))
+        return [self.names[item_id] for item_id in ranked]
+
+    def _scan_prefix(self, pairs, query, add, rank):
+        # collect prefix hits in rank order, the shortest names come first
+        hits = []
+        position = bisect_left(pairs, (query, -1))
+        while position < len(pairs) and pairs[position][0].startswith(query):
+            hits.append(pairs[position][1])
+            position += 1
+        hits.sort(key=lambda i: (len(self.normalized[i]), self.normalized[i]))
+        for item_id in hits:
+            if add(item_id, rank):
+                return True
+        return False
+
+    def _substring_matches(self, query, user_id):
+        query = fold(query)
+        previous = self.memo.get(user_id) if user_id is not None else None
+        if user_id is not None:
+            hit = previous is not None and query.startswith(previous[0])
+            metrics.cache_requests.inc(cache='autocomplete', result='hit' if hit else 'miss')
+        if previous is not None and query.startswith(previous[0]):
+            # the user kept typing, only the previous matches can still match
+            candidates = previous[1]
+        elif len(query) >= 3:
+            grams = sorted(trigrams(query), key=lambda gram: len(self.trigram_index.get(gram, ())))
+            candidates = set(self.trigram_index.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(self.trigram_index.get(gram, ()))
+        else:
+            candidates = range(len(self.normalized))
+        matches = tuple(item_id for item_id in candidates if query in self.folded[item_id])
+
+        if user_id is not None:
+            self.memo[user_id] = (query, matches)
+            self.memo.move_to_end(user_id)
+            if len(self.memo) > MEMO_SIZE:
+                self.memo.popitem(last=False)
+        return matches
+
+    def _fuzzy_matches(self, query, exclude):
+        # typo tolerance: score items sharing the most trigrams with the query
+        query = fold(query)
+        if len(query) < 3:
+            return []
+        shared = Counter()
+        for gram in trigrams(query):
+            shared.update(self.trigram_index.get(gram, ()))
+        scored = []
+        matcher = SequenceMatcher(autojunk=False)
+        matcher.set_seq2(query)
+        for item_id, _ in shared.most_common(FUZZY_CANDIDATES):
+            if item_id in exclude:
+                continue
+            folded = self.folded[item_id]
+            best = 0
+            for candidate in (folded, *folded.split(' ')):
+                matcher.set_seq1(candidate)
+                best = max(best, matcher.ratio())
+            if best >= FUZZY_CUTOFF:
+                scored.append((-best, item_id))
+        scored.sort()
+        return [item_id for _, item_id in scored]
@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from utils import metrics
+from utils.catalog import build_catalog
+from utils.recipes import build_recipes
+from utils.response_cache import ResponseCache
+from utils.search_index import SearchIndex
+from utils.snapshot_file import load_snapshot, save_snapshot
+from utils.validation import validate
+
+logger = logging.getLogger(__name__)
+
+_versions = itertools.count(1)
+
+# prices count as outdated when the sheet could not be checked for this long
+STALE_AFTER = 30 * 60  # seconds
+
+
+class SheetSnapshot:
+    # Everything the commands read from one load of the spreadsheet. A snapshot is never
+    # changed after it is built (except for suggested_items and the response cache),
+    # refreshes swap in a new one.
+    __slots__ = ('catalog', 'search_index', 'recipes', 'validation', 'suggested_items', 'revision', 'loaded_at', 'version', 'responses')
+
+    def __init__(self, catalog, search_index, recipes, validation, suggested_items, revision, loaded_at):
+        self.catalog = catalog
+        self.search_index = search_index
+        self.recipes = recipes
+        self.validation = validation
+        self.suggested_items = suggested_items
+        self.revision = revision
+        self.loaded_at = loaded_at
+        self.version = next(_versions)
+        self.responses = ResponseCache()
+
+    def age(self):
+        return time.time() - self.loaded_at
+
+
+def build_snapshot(item_rows, suggestion_rows, calculation_rows, revision=None, loaded_at=None):
+    catalog = build_catalog(item_rows)
+    recipes = build_recipes(calculation_rows)
+    return SheetSnapshot(
+        catalog=catalog,
+        search_index=SearchIndex(catalog.names),
+        recipes=recipes,
+        validation=validate(catalog, recipes),
+        suggested_items={row[1] for row in suggestion_rows[1:] if len(row) > 1 and row[1]},
+        revision=revision,
+        loaded_at=time.time() if loaded_at is None else loaded_at,
+    )
+
+
+def log_validation(snapshot):
+    if snapshot.validation.issue_count():
+        logger.warning(f'Sheet check found {snapshot.validation.summary()}, see /pruefung')
+    else:
+        logger.info('Sheet check found no problems')
+
+
+class SheetStore:
+    # Holds the current snapshot of one spreadsheet. Concurrent refreshes share a single
+    # fetch and the sheet is only downloaded again when its revision changed.
+
+    def __init__(self, fetch_rows, fetch_revision, snapshot_path=None, history=None):
+        # both get urgent=True when a user is waiting for the result
+        self.fetch_rows = fetch_rows  # async (urgent) -> (item_rows, suggestion_rows, calculation_rows)
+        self.fetch_revision = fetch_revision  # async (urgent) -> revision string or None
+        self.snapshot_path = snapshot_path
+        self.history = history  # PriceHistory that gets the price changes of every download
+        self.snapshot = None
+        self.synced_at = None  # last time the snapshot was confirmed to match the sheet
+        self._refresh_task = None
+        self._refresh_forced = False
+        self._load_task = None
+
+    async def load_from_disk(self):
+        # serve the last saved snapshot until the sheet could be read again
+        task = self._load_task
+        if task is None or task.done():
+            task = self._load_task = asyncio.create_task(self._load_from_disk())
+        return await asyncio.shield(task)
+
+    async def _load_from_disk(self):
+        if self.snapshot_path is None:
+            return None
+        saved = await asyncio.to_thread(load_snapshot, self.snapshot_path)
+        if saved is None:
+            return None
+        rows, revision, loaded_at = saved
+        snapshot = await asyncio.to_thread(build_snapshot, *rows, revision, loaded_at)
+        if self.snapshot is None:
+            self.snapshot = snapshot
+            # after unload() the sheet may have been checked later than the file was written
+            self.synced_at = max(self.synced_at or loaded_at, loaded_at)
+            logger.info(f'Loaded saved snapshot with {len(snapshot.catalog)} items from {self.snapshot_path}')
+            log_validation(snapshot)
+        return self.snapshot
+
+    def unload(self):
+        # frees the memory of an idle sheet, get_snapshot() reads the saved snapshot again
+        self.snapshot = None
+        # finished tasks still hold the snapshot they returned
+        if self._refresh_task is not None and self._refresh_task.done():
+            self._refresh_task = None
+        if self._load_task is not None and self._load_task.done():
+            self._load_task = None
+
+    def staleness(self):
+        if self.synced_at is None:
+            return None
+        return time.time() - self.synced_at
+
+    def is_stale(self):
+        staleness = self.staleness()
+        return staleness is not None and staleness > STALE_AFTER
+
+    async def get_snapshot(self):
+        if self.snapshot is None:
+            metrics.cache_requests.inc(cache='snapshot', result='miss')
+            # never loaded or unloaded before, the saved snapshot answers without asking google
+            await self.load_from_disk()
+            if self.snapshot is None:
+                await self.refresh(urgent=True)
+        else:
+            metrics.cache_requests.inc(cache='snapshot', result='hit')
+        return self.snapshot
+
+    async def refresh(self, force=False, urgent=False):
+        task = self._refresh_task
+        if task is not None and not task.done():
+            if not force or self._refresh_forced:
+                return await asyncio.shield(task)
+            # a forced refresh must not be answered by a check that skipped the download
+            await asyncio.shield(task)
+            return await self.refresh(force=True, urgent=urgent)
+        self._refresh_forced = force
+        self._refresh_task = asyncio.create_task(self._refresh(force, urgent))
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self, force, urgent):
+        try:
+            # read the revision before the values so a change during the download is not missed
+            revision = None
+            try:
+                revision = await self.fetch_revision(urgent)
+            except Exception as e:
+                logger.warning(f'Could not check the sheet revision: {e}')
+            if not force and self.snapshot is not None and revision is not None and revision == self.snapshot.revision:
+                logger.info('Sheet unchanged, keeping the current snapshot')
+                self.synced_at = time.time()
+                return self.snapshot
+
+            item_rows, suggestion_rows, calculation_rows = await self.fetch_rows(urgent)
+            # building the indexes takes a moment on large sheets, keep the event loop free
+            snapshot = await asyncio.to_thread(build_snapshot, item_rows, suggestion_rows, calculation_rows, revision)
+            self.snapshot = snapshot
+            self.synced_at = snapshot.loaded_at
+            logger.info(f'Loaded sheet snapshot {snapshot.version} with {len(snapshot.catalog)} items and {len(snapshot.recipes)} recipes')
+            log_validation(snapshot)
+            if self.snapshot_path is not None:
+                try:
+                    await asyncio.to_thread(save_snapshot, self.snapshot_path, [item_rows, suggestion_rows, calculation_rows], revision, snapshot.loaded_at)
+                except Exception as e:
+                    logger.warning(f'Could not save snapshot to {self.snapshot_path}: {e}')
+            if self.history is not None:
+                try:
+                    changes = await asyncio.to_thread(self.history.record, snapshot.catalog, snapshot.loaded_at)
+                    logger.info(f'Recorded {changes} price changes')
+                except Exception as e:
+                    logger.warning(f'Could not record price history in {self.history.path}: {e}')
+            return snapshot
+        except Exception as e:
+            logger.error(f'Error loading sheet: {e}')
+            return self.snapshot
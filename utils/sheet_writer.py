@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import requests
+
+from utils.files import atomic_write
+from utils.sheets_scheduler import not_sent, status_code
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+FLUSH_INTERVAL = 5  # seconds
+
+
+def is_rejected(error):
+    # google refused the rows, or the request went out and the answer was lost so the rows
+    # may already be in the sheet. anything else (quota, 5xx, credentials) is tried again
+    code = status_code(error)
+    if code is not None:
+        return 400 <= code < 500 and code != 429
+    return not not_sent(error) and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, asyncio.TimeoutError))
+
+
+class SheetWriter:
+    # Write-behind queue for rows appended to the sheet. Rows are kept per table range,
+    # appended to a journal file and written in batches by a background task. The journal
+    # has one [table_range, row] line per row and is rewritten after rows were written. Retrying is left to
+    # the scheduler, a batch that still fails waits for the next flush or, if google
+    # rejected it, is moved to the rejected file.
+
+    def __init__(self, append_rows, journal_path):
+        self.append_rows = append_rows  # async callable(table_range, rows)
+        self.journal_path = journal_path
+        self.rejected_path = f'{os.path.splitext(journal_path)[0]}_rejected.jsonl'
+        self.pending = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # journal appends and rewrites in order, a rewrite must not drop a row appended meanwhile
+        self._journal_lock = asyncio.Lock()
+        self._journal_stale = False  # the journal still lists rows that were written
+        self._task = None
+
+    def start(self):
+        self._load_journal()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self.queue_depth():
+            logger.warning(f'{self.queue_depth()} rows could not be written and stay in {self.journal_path}')
+
+    async def enqueue(self, table_range, row):
+        # returns once the row is in the journal, raises and queues nothing if it could not be saved
+        row = list(row)
+        async with self._journal_lock:
+            await asyncio.to_thread(self._append_journal, table_range, row)
+            rows = self.pending.setdefault(table_range, [])
+            rows.append(row)
+        if len(rows) >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def queue_depth(self):
+        return sum(len(rows) for rows in self.pending.values())
+
+    def is_pending(self, table_range, column, value):
+        return any(row[column] == value for row in self.pending.get(table_range, ()))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # the rows stay queued, the next flush tries again
+                logger.error(f'Error flushing the write queue: {e}')
+
+    async def flush(self):
+        async with self._flush_lock:
+            for table_range in list(self.pending):
+                while self.pending.get(table_range):
+                    batch = self.pending[table_range][:BATCH_SIZE]
+                    if not await self._write(table_range, batch):
+                        break
+                    # rows queued during the write stay in the list
+                    del self.pending[table_range][:len(batch)]
+                    await self._save_journal()
+                if not self.pending.get(table_range):
+                    self.pending.pop(table_range, None)
+            if self._journal_stale:
+                await self._save_journal()
+
+    async def _write(self, table_range, rows):
+        # True when the batch left the queue, written or rejected
+        try:
+            await self.append_rows(table_range, rows)
+        except Exception as e:
+            if not is_rejected(e):
+                logger.warning(f'Writing {len(rows)} rows to {table_range} failed, trying again with the next flush: {e}')
+                return False
+            # sending it again would fail the same way or, without an answer, may add the rows twice
+            code = status_code(e)
+            reason = f'rejected by google ({code})' if code is not None else 'no answer from google, the rows may already be in the sheet'
+            try:
+                await asyncio.to_thread(self._save_rejected, table_range, rows, str(e))
+            except OSError as save_error:
+                logger.error(f'Could not move {len(rows)} rows for {table_range} to {self.rejected_path}: {save_error}')
+                return False
+            logger.error(f'Moved {len(rows)} rows for {table_range} to {self.rejected_path}, {reason}: {e}')
+            return True
+        logger.info(f'Wrote {len(rows)} rows to {table_range}')
+        return True
+
+    def _save_rejected(self, table_range, rows, error):
+        os.makedirs(os.path.dirname(self.rejected_path) or '.', exist_ok=True)
+        with open(self.rejected_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.time(), 'range': table_range, 'rows': rows, 'error': error}, ensure_ascii=False) + '\n')
+
+    def _load_journal(self):
+        try:
+            with open(self.journal_path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f'Could not read write journal {self.journal_path}: {e}')
+            return
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                table_range, row = json.loads(line)
+            except (TypeError, ValueError):
+                # a line cut off by a crash, its command was never answered
+                logger.warning(f'Skipping unreadable line in {self.journal_path}: {line[:100]}')
+                continue
+            self.pending.setdefault(table_range, []).append(row)
+        if self.pending:
+            logger.info(f'Recovered {self.queue_depth()} unwritten rows from {self.journal_path}')
+
+    def _append_journal(self, table_range, row):
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps([table_range, row], ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _save_journal(self):
+        # drops the written rows from the journal
+        async with self._journal_lock:
+            lines = [json.dumps([table_range, row], ensure_ascii=False) for table_range, rows in self.pending.items() for row in rows]
+            try:
+                await asyncio.to_thread(self._write_journal, lines)
+            except OSError as e:
+                # the written rows would be sent again after a restart, the next flush rewrites it
+                self._journal_stale = True
+                logger.error(f'Could not rewrite write journal {self.journal_path}: {e}')
+                return
+            self._journal_stale = False
+
+    def _write_journal(self, lines):
+        # a crash never leaves a half written journal
+        with atomic_write(self.journal_path, encoding='utf-8', fsync=True) as f:
+            f.write(''.join(f'{line}\n' for line in lines))
@@ -0,0 +1,209 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+import requests
+import urllib3
+from google.auth.exceptions import RefreshError, TransportError
+
+from utils import metrics
+from utils.sheets_transport import SheetsTransport
+
+logger = logging.getLogger(__name__)
+
+READ = 'read'
+WRITE = 'write'
+
+# priorities, lower runs first
+USER_READ = 0
+BACKGROUND_READ = 1
+WRITE_PRIORITY = 2
+
+# Google Sheets API quotas: requests per minute per user and per project.
+# the bot talks to google as one service account, so the user quota is the one that bites.
+QUOTAS = {
+    READ: (60, 300),
+    WRITE: (60, 300),
+}
+MAX_CONCURRENT = 4
+MAX_RETRIES = 5
+BACKOFF_BASE = 1  # seconds
+BACKOFF_MAX = 64  # seconds
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        # seconds until one token is available
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Job:
+    __slots__ = ('func', 'args', 'kind', 'priority', 'key', 'future', 'started', 'attempt')
+
+    def __init__(self, func, args, kind, priority, key, future):
+        self.func = func
+        self.args = args
+        self.kind = kind
+        self.priority = priority
+        self.key = key
+        self.future = future
+        self.started = False
+        self.attempt = 0
+
+
+def status_code(error):
+    # http status of an error google answered with, None if there was no answer
+    code = getattr(error, 'code', None)
+    if code is None:
+        response = getattr(error, 'response', None)
+        code = getattr(response, 'status_code', None)
+    return code if isinstance(code, int) else None
+
+
+def not_sent(error):
+    # no connection to google could be opened, so the request never reached it.
+    # google-auth raises before the request when the access token could not be refreshed
+    if isinstance(error, (requests.exceptions.ConnectTimeout, RefreshError, TransportError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def is_retryable(error, kind=READ):
+    # 429 (quota) and 5xx answers mean google did not apply the request, so it is sent again.
+    # after a timeout or dropped connection a write may already be in the sheet, only reads are repeated
+    code = status_code(error)
+    if code == 429 or (code is not None and 500 <= code < 600) or not_sent(error):
+        return True
+    return kind == READ and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, asyncio.TimeoutError))
+
+
+class SheetsScheduler:
+    # Every Google Sheets call goes through here. Calls are rate limited per quota, run
+    # by priority, identical pending reads share one request and transient errors are retried.
+
+    def __init__(self):
+        self.buckets = {kind: [TokenBucket(limit) for limit in limits] for kind, limits in QUOTAS.items()}
+        self._queue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._pending = {}  # coalescing key -> job
+        self._slots = asyncio.Semaphore(MAX_CONCURRENT)
+        self._running = set()
+        self._task = None
+        # MAX_CONCURRENT calls run at once, so that many threads are enough
+        self.transport = SheetsTransport(MAX_CONCURRENT)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        # nobody will run the queued calls anymore, do not leave their callers waiting
+        while not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+        self._pending.clear()
+        self.transport.close()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    async def submit(self, func, *args, kind=READ, priority=USER_READ, key=None):
+        self.start()
+        job = self._pending.get(key) if key is not None else None
+        if job is not None:
+            if priority < job.priority and not job.started:
+                # someone is waiting for this read now, move it up the queue
+                job.priority = priority
+                self._queue.put_nowait((priority, next(self._sequence), job))
+        else:
+            job = Job(func, args, kind, priority, key, asyncio.get_running_loop().create_future())
+            if key is not None:
+                self._pending[key] = job
+            self._queue.put_nowait((priority, next(self._sequence), job))
+        # a caller giving up must not cancel the request for the others waiting on it
+        return await asyncio.shield(job.future)
+
+    def _delay(self, kind):
+        return max(bucket.delay() for bucket in self.buckets[kind])
+
+    async def _dispatch(self):
+        while True:
+            priority, sequence, job = await self._queue.get()
+            if job.started or job.future.done() or priority != job.priority:
+                continue  # stale entry of a promoted or finished job
+            delay = self._delay(job.kind)
+            if delay > 0:
+                # out of quota, check again soon in case something more urgent arrived
+                self._queue.put_nowait((priority, sequence, job))
+                await asyncio.sleep(min(delay, 0.5))
+                continue
+            try:
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                # closing, back into the queue so close() cancels it with the others
+                self._queue.put_nowait((priority, sequence, job))
+                raise
+            for bucket in self.buckets[job.kind]:
+                bucket.take()
+            job.started = True
+            task = asyncio.create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, job):
+        start = time.perf_counter()
+        try:
+            result = await self.transport.call(job.func, *job.args)
+        except Exception as e:
+            metrics.google_api_errors.inc(call=job.func.__name__)
+            if is_retryable(e, job.kind) and job.attempt + 1 < MAX_RETRIES:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** job.attempt))
+                logger.warning(f'Google API call {job.func.__name__} failed ({e}), retrying in {delay:.1f}s')
+                job.attempt += 1
+                self._slots.release()
+                await asyncio.sleep(delay)
+                job.started = False
+                self._queue.put_nowait((job.priority, next(self._sequence), job))
+                return
+            self._finish(job)
+            job.future.set_exception(e)
+        else:
+            metrics.google_api_duration.observe(time.perf_counter() - start, call=job.func.__name__)
+            self._finish(job)
+            job.future.set_result(result)
+        self._slots.release()
+
+    def _finish(self, job):
+        if job.key is not None and self._pending.get(job.key) is job:
+            del self._pending[job.key]
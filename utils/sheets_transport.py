@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# a call that has not returned by then is given up, the http timeouts in
+# google_sheets end the thread behind it shortly after
+CALL_TIMEOUT = 60  # seconds
+
+
+class SheetsTransport:
+    # Runs the blocking gspread calls on a fixed pool of threads of its own, so google
+    # can neither block the event loop nor use up the default executor.
+
+    def __init__(self, workers, timeout=CALL_TIMEOUT):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheets')
+
+    async def call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+
+        def mark_started():
+            if not started.done():
+                started.set_result(None)
+
+        def run():
+            loop.call_soon_threadsafe(mark_started)
+            return func(*args)
+
+        future = loop.run_in_executor(self._executor, run)
+        try:
+            # waiting for a free thread is not google being slow, the timeout starts with the call
+            await asyncio.wait((started, future), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        return await asyncio.wait_for(future, self.timeout)
+
+    def close(self):
+        # calls still waiting for a thread are dropped, running ones end with their http timeout
+        self._executor.shutdown(wait=False, cancel_futures=True)
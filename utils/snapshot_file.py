@@ -0,0 +1,51 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from utils import google_sheets
+from utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# a snapshot written for other ranges or another file layout is ignored instead of misread
+SCHEMA_HASH = hashlib.sha1(json.dumps([
+    FORMAT_VERSION,
+    google_sheets.ITEMS_RANGE,
+    google_sheets.SUGGESTIONS_RANGE,
+    google_sheets.CALCULATIONS_RANGE,
+]).encode()).hexdigest()[:12]
+
+
+def snapshot_path(spreadsheet_id):
+    return os.path.join('data', f'snapshot_{spreadsheet_id}.json.gz')
+
+
+def save_snapshot(path, rows, revision, loaded_at):
+    payload = {
+        'schema': SCHEMA_HASH,
+        'revision': revision,
+        'loaded_at': loaded_at,
+        'rows': rows,
+    }
+    # fast compression, the file is written on every refresh
+    with atomic_write(path, 'wt', opener=gzip.open, encoding='utf-8', compresslevel=1) as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_snapshot(path):
+    # returns (rows, revision, loaded_at) or None if there is no usable snapshot
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f'Ignoring unreadable snapshot {path}: {e}')
+        return None
+    if payload.get('schema') != SCHEMA_HASH:
+        logger.info(f'Ignoring snapshot {path} written with another schema')
+        return None
+    return payload['rows'], payload['revision'], payload['loaded_at']
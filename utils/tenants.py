@@ -0,0 +1,155 @@
+import collections
+import logging
+import os
+
+from utils import google_sheets, metrics
+from utils.price_history import PriceHistory, history_path
+from utils.sheet_store import SheetStore
+from utils.sheet_writer import SheetWriter
+from utils.sheets_scheduler import BACKGROUND_READ, USER_READ, WRITE, WRITE_PRIORITY
+from utils.snapshot_file import snapshot_path
+
+logger = logging.getLogger(__name__)
+
+def parse_guild_sheets(value):
+    # "guild_id:spreadsheet_id,guild_id:spreadsheet_id" -> {guild_id: spreadsheet_id}
+    guild_sheets = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        guild_id, _, spreadsheet_id = entry.partition(':')
+        if not spreadsheet_id.strip():
+            raise ValueError(f'GUILD_SHEETS entry "{entry}" has no spreadsheet id.')
+        try:
+            guild_sheets[int(guild_id)] = spreadsheet_id.strip()
+        except ValueError:
+            raise ValueError(f'GUILD_SHEETS entry "{entry}" does not start with a guild id.')
+    return guild_sheets
+
+
+def guild_sheets_from_env():
+    # GUILD_SHEETS=guild_id:spreadsheet_id,... gives every guild its own sheet,
+    # otherwise all GUILD_IDS share SPREADSHEET_ID
+    guild_sheets_env = os.getenv('GUILD_SHEETS')
+    if guild_sheets_env:
+        return parse_guild_sheets(guild_sheets_env)
+    guild_ids_env = os.getenv('GUILD_IDS')
+    if guild_ids_env is None:
+        raise ValueError("GUILD_IDS or GUILD_SHEETS environment variable is not set.")
+    try:
+        guild_ids = [int(id) for id in guild_ids_env.split(',')]
+    except ValueError:
+        raise ValueError("GUILD_IDS must be a comma-separated list of integers.")
+    return dict.fromkeys(guild_ids, os.getenv('SPREADSHEET_ID'))
+
+
+def journal_path(spreadsheet_id):
+    return os.path.join('data', f'pending_writes_{spreadsheet_id}.json')
+
+
+def snapshot_weight(snapshot):
+    # rough memory cost in items, the catalog, search index and recipes grow with them
+    return len(snapshot.catalog) + len(snapshot.recipes)
+
+
+class Tenant:
+    # One spreadsheet with its snapshot and write queue. Guilds that use the same
+    # spreadsheet share the tenant, all tenants share the client and the scheduler.
+
+    def __init__(self, spreadsheet_id, scheduler):
+        self.spreadsheet_id = spreadsheet_id
+        self.scheduler = scheduler
+        self.history = PriceHistory(history_path(spreadsheet_id))
+        self.store = SheetStore(self.fetch_sheet_rows, self.fetch_revision, snapshot_path(spreadsheet_id), self.history)
+        self.writer = SheetWriter(self.append_suggestion_rows, journal_path(spreadsheet_id))
+
+    async def append_suggestion_rows(self, table_range, rows):
+        await self.scheduler.submit(google_sheets.append_rows, self.spreadsheet_id, 'Anpassungen', table_range, rows,
+                                    kind=WRITE, priority=WRITE_PRIORITY)
+
+    async def fetch_sheet_rows(self, urgent):
+        rows = await self.scheduler.submit(google_sheets.fetch_values, self.spreadsheet_id,
+                                           priority=USER_READ if urgent else BACKGROUND_READ, key=('values', self.spreadsheet_id))
+        logger.info(f'Loaded sheets of {self.spreadsheet_id}')
+        return rows
+
+    async def fetch_revision(self, urgent):
+        return await self.scheduler.submit(google_sheets.fetch_revision, self.spreadsheet_id,
+                                           priority=USER_READ if urgent else BACKGROUND_READ, key=('revision', self.spreadsheet_id))
+
+
+class TenantRegistry:
+    # Maps guilds to tenants and keeps the loaded snapshots within max_items. The least
+    # recently used snapshots are dropped first, their saved copy on disk stays and is
+    # loaded again by the next command for that sheet.
+
+    def __init__(self, guild_sheets, scheduler, max_items):
+        self.guild_sheets = guild_sheets
+        self.max_items = max_items
+        self.tenants = {spreadsheet_id: Tenant(spreadsheet_id, scheduler) for spreadsheet_id in dict.fromkeys(guild_sheets.values())}
+        self._recent = collections.OrderedDict()  # spreadsheet ids of loaded snapshots, least recently used first
+
+    def for_guild(self, guild_id):
+        spreadsheet_id = self.guild_sheets.get(guild_id)
+        return None if spreadsheet_id is None else self.tenants[spreadsheet_id]
+
+    def start(self):
+        for tenant in self.tenants.values():
+            tenant.writer.start()
+
+    async def close(self):
+        for tenant in self.tenants.values():
+            await tenant.writer.close()
+
+    def loaded(self):
+        return [tenant for tenant in self.tenants.values() if tenant.store.snapshot is not None]
+
+    def loaded_items(self):
+        return sum(snapshot_weight(tenant.store.snapshot) for tenant in self.loaded())
+
+    async def get_snapshot(self, tenant):
+        snapshot = await tenant.store.get_snapshot()
+        self.touch(tenant)
+        return snapshot
+
+    def touch(self, tenant):
+        if tenant.store.snapshot is None:
+            return
+        self._recent[tenant.spreadsheet_id] = None
+        self._recent.move_to_end(tenant.spreadsheet_id)
+        self.evict(keep=tenant)
+
+    def evict(self, keep=None):
+        # a refresh that was still running when its sheet was dropped loads it again without
+        # touch(), such sheets are not in _recent and count as the least recently used
+        for spreadsheet_id in [spreadsheet_id for spreadsheet_id in self._recent if self.tenants[spreadsheet_id].store.snapshot is None]:
+            del self._recent[spreadsheet_id]
+        loaded = self.loaded()
+        total = sum(snapshot_weight(tenant.store.snapshot) for tenant in loaded)
+        untracked = [tenant for tenant in loaded if tenant.spreadsheet_id not in self._recent]
+        # the most recently used sheet stays even if it alone is over the budget,
+        # dropping it would only mean reading it from disk again on the next command
+        recent = [self.tenants[spreadsheet_id] for spreadsheet_id in self._recent][:-1]
+        for tenant in untracked + recent:
+            if total <= self.max_items:
+                break
+            if tenant is keep:
+                continue
+            self._recent.pop(tenant.spreadsheet_id, None)
+            total -= snapshot_weight(tenant.store.snapshot)
+            tenant.store.unload()
+            metrics.snapshot_evictions.inc()
+            logger.info(f'Dropped the idle snapshot of {tenant.spreadsheet_id} from memory, {total} of {self.max_items} items loaded')
+
+    async def warm_up(self):
+        # load saved snapshots at startup while they fit, downloads are left to the
+        # refresh loop and the first command for a sheet
+        for tenant in self.tenants.values():
+            loaded = len(self.loaded())
+            if await tenant.store.load_from_disk() is None:
+                continue
+            self.touch(tenant)
+            if len(self.loaded()) <= loaded:
+                # the budget is full, loading more would only drop the earlier ones again
+                break
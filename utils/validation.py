@@ -0,0 +1,25 @@
+class ValidationReport:
+    __slots__ = ('duplicates', 'bad_prices', 'bad_margins', 'missing_ingredients')
+
+    def __init__(self, duplicates, bad_prices, bad_margins, missing_ingredients):
+        self.duplicates = duplicates  # name -> sheet rows the name appears in
+        self.bad_prices = bad_prices  # [(sheet row, name, cell)], these items cost 0
+        self.bad_margins = bad_margins  # [(sheet row, name, cell)], these items have 0% margin
+        self.missing_ingredients = missing_ingredients  # [(recipe, ingredient)]
+
+    def issue_count(self):
+        return len(self.duplicates) + len(self.bad_prices) + len(self.bad_margins) + len(self.missing_ingredients)
+
+    def summary(self):
+        return (f'{len(self.duplicates)} duplicate items, {len(self.bad_prices)} unreadable prices, '
+                f'{len(self.bad_margins)} unreadable margins, {len(self.missing_ingredients)} unknown ingredients')
+
+
+def validate(catalog, recipes):
+    # build_catalog already collected the problems of 'Alle Items', this adds one pass over the recipes
+    missing_ingredients = []
+    for recipe in recipes.recipes.values():
+        for ingredient, _ in recipe.ingredients:
+            if ingredient not in catalog:
+                missing_ingredients.append((recipe.item, ingredient))
+    return ValidationReport(catalog.duplicates, catalog.bad_prices, catalog.bad_margins, missing_ingredients)